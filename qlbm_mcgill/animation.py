@@ -0,0 +1,375 @@
+# Rendering of QLBM animations
+# Kept apart from base.py (and its Qiskit/QLBM imports), so that the processes of a parallel
+# render start quickly. PyVista is imported where it is used, and the heatmap previews do not need it.
+from __future__ import annotations
+
+from collections import deque
+from multiprocessing import shared_memory
+from os import cpu_count, path
+from typing import Callable, Iterator
+
+import numpy as np
+from PIL import Image, ImageChops, ImageDraw, GifImagePlugin
+
+# "Macros"
+GIF_DURATION = 6 # ms per frame
+VIDEO_FPS = 10
+RENDER_BLOCK_FRAMES = 16 # most frames a process renders at once
+PREVIEW_SIZE = 512 # pixels, longest side of the grid in previews
+RENDER_BACKENDS = ["pyvista", "numpy"]
+# ffmpeg settings of the video formats that differ from the defaults of imageio-ffmpeg (H.264 for ".mp4")
+VIDEO_SETTINGS = {
+    ".webp": dict(codec="libwebp_anim", pix_fmt_in="rgba", pix_fmt_out="yuva420p", output_params=["-loop", "0"]),
+}
+
+# Anchors of the viridis colormap (PyVista's default), interpolated into a 256 color lookup table
+VIRIDIS = np.array([
+    [68, 1, 84], [71, 45, 123], [59, 82, 139], [44, 114, 142], [33, 145, 140],
+    [40, 174, 128], [94, 201, 98], [173, 220, 48], [253, 231, 37],
+])
+
+SCALAR_BAR_ARGS = dict(
+    title="Measurements at gridpoint",
+    title_font_size=20,
+    label_font_size=16,
+    shadow=True,
+    n_labels=3,
+    italic=True,
+    fmt="%.1f",
+    font_family="arial",
+    position_x=0.2,  # Centering the scalar bar
+    position_y=0.05,
+)
+
+class AnimationWriter():
+    """
+    Appends the frames of an animation to its file as soon as they are rendered, so that only
+    the last frame is ever kept in memory. The format follows the extension of the file:
+    ".gif" frames are quantized to a palette of "colors" colors (at most 256) and written with PIL;
+    any other extension (".mp4", ".webm", ".webp", ...) is piped to ffmpeg frame by frame
+    (this requires the imageio-ffmpeg package).
+    Attributes:
+        output_filename: str
+        colors: int, size of the palette of every GIF frame
+        count: int, number of frames written so far
+    """
+    output_filename: str
+    colors: int
+    count: int
+
+    def __init__(
+            self,
+            output_filename: str,
+            colors: int = 256
+        ) -> None:
+        if not 2 <= colors <= 256:
+            raise ValueError("colors must be between 2 and 256")
+        self.output_filename = output_filename
+        self.colors = colors
+        self.count = 0
+        self.previous = None
+
+        self.extension = path.splitext(output_filename)[1].lower()
+        self.file = open(output_filename, "wb") if self.extension == ".gif" else None
+        self.video = None
+
+    def append(self, img: np.ndarray | Image.Image):
+        """
+        Writes a frame, given as an RGB(A) array or a PIL image. Paletted ("P") images are written as they are.
+        """
+        if self.file is not None:
+            self.append_gif(img if isinstance(img, Image.Image) else Image.fromarray(img))
+        else:
+            self.append_video(np.asarray(img.convert("RGBA")) if isinstance(img, Image.Image) else img)
+        self.count += 1
+
+    def append_video(self, img: np.ndarray):
+        settings = dict(pix_fmt_in="rgb24")
+        settings.update(VIDEO_SETTINGS.get(self.extension, {}))
+        if self.video is None:
+            import imageio_ffmpeg
+            # The size of the video is only known once the first frame is rendered
+            self.video = imageio_ffmpeg.write_frames(
+                self.output_filename, (img.shape[1], img.shape[0]), fps=VIDEO_FPS, **settings
+            )
+            self.video.send(None)
+        channels = 4 if settings["pix_fmt_in"] == "rgba" else 3
+        self.video.send(np.ascontiguousarray(img[..., :channels]))
+
+    def append_gif(self, frame: Image.Image):
+        """
+        Writes a frame as a GIF image block with its own (local) palette. Past the first frame,
+        only the part that changed since the previous frame is written.
+        """
+        if frame.mode == "P":
+            im = frame
+        else:
+            im = frame.convert("P", palette=Image.Palette.ADAPTIVE, colors=self.colors)
+        info = dict(duration=GIF_DURATION, include_color_table=True)
+        if im.palette.mode == "RGBA":
+            for rgba, index in im.palette.colors.items():
+                if rgba[3] == 0:
+                    info["transparency"] = index
+                    break
+
+        offset = (0, 0)
+        if self.previous is None:
+            header, _ = GifImagePlugin.getheader(im, info=dict(loop=0))
+            self.file.write(b"".join(header))
+        else:
+            bbox = ImageChops.difference(self.previous, frame).getbbox(alpha_only=False)
+            if bbox is None:
+                # Nothing changed: still write a single pixel, so that every frame is kept
+                bbox = (0, 0, 1, 1)
+            im = im.crop(bbox)
+            offset = bbox[:2]
+        self.file.write(b"".join(GifImagePlugin.getdata(im, offset, **info)))
+        self.previous = frame.copy()
+
+    def close(self):
+        if self.file is not None:
+            self.file.write(b";") # GIF trailer
+            self.file.close()
+        elif self.video is not None:
+            self.video.close()
+
+    def __enter__(self) -> AnimationWriter:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def render_animation(
+        grid,
+        scalars: list[np.ndarray] | np.ndarray,
+        stl_mesh,
+        output_filename: str,
+        on_frame: Callable[[int, int], None] | None = None,
+        num_processes: int | None = 1,
+        colors: int = 256
+    ):
+    """
+    Renders one frame per array of point scalars of grid, with the obstacles on top, and streams them
+    to output_filename (see AnimationWriter).
+    on_frame: called with (frame, last frame) after every frame is written
+    num_processes: int | None, spread the frames over a pool of processes (None: one per CPU)
+    colors: int, palette size of GIF frames
+    (NOT MY WORK: credit to QLBM)
+    """
+    scalars = np.asarray(scalars, dtype=np.float32)
+
+    # Find the global maximum scalar value
+    max_scalar = max(0, scalars.max())
+
+    if num_processes == 1:
+        frames = render_frames(grid, scalars, stl_mesh, max_scalar, 0, len(scalars))
+    else:
+        frames = render_frames_parallel(grid, scalars, stl_mesh, max_scalar, num_processes)
+
+    with AnimationWriter(output_filename, colors=colors) as writer:
+        for c, img in enumerate(frames):
+            writer.append(img)
+            if on_frame is not None:
+                on_frame(c, len(scalars) - 1)
+
+def render_frames(
+        grid,
+        scalars: np.ndarray,
+        stl_mesh,
+        max_scalar: float,
+        start: int,
+        num_frames: int
+    ) -> Iterator[np.ndarray]:
+    """
+    Renders frames start, start+1, ... of an animation of num_frames frames, one per row of scalars,
+    and yields them (with the progress bar) one at a time.
+    A single off-screen plotter is set up once; the scalars of its mesh are updated in place between screenshots.
+    """
+    import pyvista as pv
+
+    time_step_mesh = grid.copy()
+    time_step_mesh.point_data.set_scalars(np.array(scalars[0]), "measurements")
+
+    plotter = pv.Plotter(off_screen=True)
+    try:
+        plotter.add_mesh(
+            time_step_mesh,
+            clim=[0, max_scalar],
+            show_edges=True,
+            scalar_bar_args=SCALAR_BAR_ARGS,
+        )
+
+        plotter.add_mesh(
+            stl_mesh,
+            show_scalar_bar=False,
+        )
+        plotter.view_xy()
+
+        for c, frame_scalars in enumerate(scalars, start=start):
+            time_step_mesh.point_data["measurements"][:] = frame_scalars
+            plotter.render()
+            img = plotter.screenshot(
+                transparent_background=True,
+            )
+            yield np.array(draw_progress_bar(Image.fromarray(img), c, num_frames))
+    finally:
+        # Clean up the plotter
+        plotter.close()
+
+def draw_progress_bar(
+        pil_img: Image.Image,
+        c: int,
+        num_frames: int
+    ) -> Image.Image:
+    """
+    Draws the progress bar of frame c (of num_frames) on a frame, in place.
+    """
+    draw = ImageDraw.Draw(pil_img)
+
+    # Draw progress bar
+    bar_width = int(pil_img.width * 0.8)
+    bar_height = 20
+    bar_x = (pil_img.width - bar_width) // 2
+    bar_y = pil_img.height - 40
+    progress = int((c + 1) / (num_frames) * bar_width)
+
+    draw.rectangle(
+        [bar_x, bar_y, bar_x + bar_width, bar_y + bar_height],
+        outline="black",
+        width=3,
+    )
+    draw.rectangle(
+        [bar_x, bar_y, bar_x + progress, bar_y + bar_height], fill="purple"
+    )
+
+    return pil_img
+
+def render_frames_parallel(
+        grid,
+        scalars: np.ndarray,
+        stl_mesh,
+        max_scalar: float,
+        num_processes: int | None = None
+    ) -> Iterator[np.ndarray]:
+    """
+    Same as render_frames over all the frames, but the frames are split in contiguous blocks (of at most
+    RENDER_BLOCK_FRAMES frames) rendered by a pool of processes, each with its own plotter.
+    The scalars are handed to the processes through shared memory. Frames are yielded in order, and at
+    most two blocks per process are in flight, so memory does not grow with the number of frames.
+    """
+    import pyvista as pv
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import get_context
+
+    num_processes = num_processes or cpu_count() or 1
+    block_frames = min(-(-len(scalars) // num_processes), RENDER_BLOCK_FRAMES)
+
+    shm = shared_memory.SharedMemory(create=True, size=scalars.nbytes)
+    try:
+        np.ndarray(scalars.shape, dtype=np.float32, buffer=shm.buf)[:] = scalars
+
+        # VTK's OpenGL context does not survive a fork, so the renderers are spawned
+        with ProcessPoolExecutor(max_workers=num_processes, mp_context=get_context("spawn")) as pool:
+            pending = deque()
+            for start in range(0, len(scalars), block_frames):
+                pending.append(pool.submit(
+                    _render_shared_frames, grid, stl_mesh, max_scalar, pv.global_theme,
+                    shm.name, scalars.shape, start, min(start + block_frames, len(scalars))
+                ))
+                if len(pending) == 2 * num_processes:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+    finally:
+        shm.close()
+        shm.unlink()
+
+def _render_shared_frames(
+        grid,
+        stl_mesh,
+        max_scalar: float,
+        theme,
+        shm_name: str,
+        shape: tuple,
+        start: int,
+        stop: int
+    ) -> list[np.ndarray]:
+    """
+    Worker of render_frames_parallel: renders frames start to stop - 1 from the shared scalars.
+    """
+    import pyvista as pv
+    pv.global_theme.load_theme(theme)
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        scalars = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)[start:stop].copy()
+    finally:
+        shm.close()
+    return list(render_frames(grid, scalars, stl_mesh, max_scalar, start, shape[0]))
+
+def colormap_lut(
+        anchors: np.ndarray = VIRIDIS,
+        num_levels: int = 256
+    ) -> np.ndarray:
+    """
+    Interpolates the anchor colors of a colormap into a [num_levels, 3] lookup table.
+    """
+    levels = np.linspace(0, len(anchors) - 1, num_levels)
+    return np.stack(
+        [np.interp(levels, np.arange(len(anchors)), anchors[:, channel]) for channel in range(3)], axis=-1
+    ).round().astype(np.uint8)
+
+def render_preview(
+        scalars: list[np.ndarray] | np.ndarray,
+        dimensions: tuple,
+        output_filename: str,
+        on_frame: Callable[[int, int], None] | None = None,
+        colors: int = 256
+    ):
+    """
+    Fast alternative to render_animation, for checking results: rasterizes the point scalars of an image grid
+    of the given (x, y) dimensions to heatmaps with NumPy and PIL (no PyVista/VTK), and streams them to
+    output_filename (see AnimationWriter). Every point is drawn as a square cell with edges, in the same
+    orientation as the PyVista animations, with the same color range and progress bar.
+    on_frame: called with (frame, last frame) after every frame is written
+    """
+    scalars = np.asarray(scalars, dtype=np.float32)
+    max_scalar = max(0, scalars.max())
+
+    with AnimationWriter(output_filename, colors=colors) as writer:
+        for c, img in enumerate(preview_frames(scalars, dimensions, max_scalar)):
+            writer.append(img)
+            if on_frame is not None:
+                on_frame(c, len(scalars) - 1)
+
+def preview_frames(
+        scalars: np.ndarray,
+        dimensions: tuple,
+        max_scalar: float
+    ) -> Iterator[np.ndarray]:
+    """
+    Yields the heatmap of every row of scalars (see render_preview), with the progress bar, as paletted images.
+    The palette is fixed (the colormap, then black, white and purple), so the frames need no quantization.
+    """
+    size_x, size_y = dimensions[:2]
+    cell = max(4, PREVIEW_SIZE // max(size_x, size_y))
+    num_levels = 253
+    black, white = num_levels, num_levels + 1
+    palette = np.concatenate([colormap_lut(num_levels=num_levels), [[0, 0, 0], [255, 255, 255], [128, 0, 128]]])
+    palette = palette.astype(np.uint8).tobytes()
+
+    # Cell edges, and a white margin at the bottom for the progress bar
+    edges = np.zeros((size_y * cell + 1, size_x * cell + 1), dtype=bool)
+    edges[::cell, :] = True
+    edges[:, ::cell] = True
+    canvas = np.full((edges.shape[0] + 60, edges.shape[1]), white, dtype=np.uint8)
+
+    # Points are laid out x first (as in VTK), and y points up
+    levels = np.clip(scalars / (max_scalar or 1) * (num_levels - 1), 0, num_levels - 1).astype(np.uint8)
+    levels = levels.reshape(len(scalars), size_y, size_x)[:, ::-1]
+    for c, frame_levels in enumerate(levels):
+        canvas[:-61, :-1] = np.repeat(np.repeat(frame_levels, cell, axis=0), cell, axis=1)
+        canvas[:-60][edges] = black
+        img = Image.fromarray(canvas)
+        img.putpalette(palette)
+        yield draw_progress_bar(img, c, len(scalars))
@@ -1,15 +1,13 @@
 # All imports for qlbm-mcgill
+# Heavy dependencies that only some code paths need (tensorflow/jax through PyIBU, pyvista,
+# mitiq, qiskit_ibm_runtime, qiskit_experiments) are imported where they are used,
+# so that e.g. a plain Aer simulation does not pay for them at startup.
+from __future__ import annotations
 
 # Qiskit imports
 from qiskit import QuantumCircuit, ClassicalRegister
-from qiskit import transpile
-
-from qiskit_ibm_runtime import RuntimeDecoder
-from qiskit_ibm_runtime import RuntimeEncoder
-from qiskit_ibm_runtime import QiskitRuntimeService, IBMBackend
-from qiskit_ibm_runtime import SamplerV2 as Sampler
-from qiskit_ibm_runtime import EstimatorV2 as Estimator
-from qiskit_ibm_runtime import SamplerOptions
+from qiskit import transpile, qpy
+import qiskit
 
 from qiskit_aer import AerSimulator
 from qiskit_aer.noise import NoiseModel, depolarizing_error
@@ -17,10 +15,8 @@ from qiskit_aer.primitives import SamplerV2 as SimSampler
 from qiskit_aer.primitives import EstimatorV2 as SimEstimator
 
 from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
-
-from qiskit_experiments.data_processing import LocalReadoutMitigator
-from qiskit_experiments.library import LocalReadoutError, CorrelatedReadoutError
-from qiskit_experiments.framework import ExperimentData
+from qiskit.converters import circuit_to_dag, dag_to_circuit
+from qiskit.circuit.library import get_standard_gate_name_mapping
 
 # QLBM imports
 from qlbm.components import (
@@ -43,55 +39,186 @@ from qlbm.infra.result import CollisionlessResult, SpaceTimeResult
 from qlbm.tools import flatten
 from qlbm.infra.reinitialize import CollisionlessReinitializer
 
-# PyIBU imports
-# Credit: https://github.com/sidsrinivasan/PyIBU
-from ibu_utils.qc_utils import get_response_matrix
-from ibu_src.IBU import IBU
-import tensorflow as tf
-
 # Misc imports
-from qbraid import load_program
-
 from os import listdir, chdir, path
 from shutil import rmtree
 
 from itertools import product
 
 import json
-import threading, time
+import time
+import hashlib
+from weakref import WeakKeyDictionary
+from functools import lru_cache
 
-import imageio
 import numpy as np
-import pyvista as pv
-from PIL import Image, ImageDraw
-from pyvista import themes
-
-from IPython.display import Image as Draw
 
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable
 from typing_extensions import override
 
 from math import log2
 
+from animation import render_animation, render_preview, RENDER_BACKENDS
+
 # "Macros"
 DEFAULT_SHOTS = 1024
 DEFAULT_STEPS = 1
 DEFAULT_DIMS = [4,4]
 
+class RunnerEvent():
+    """
+    A progress event emitted by a Runner to its subscribers.
+    Attributes:
+        kind: str, "start" or "end" of a stage, or "progress" within it
+        stage: str, e.g. "build", "transpile", "execute", "mitigate" or "render"
+        time: float, when the event was emitted (seconds since the epoch)
+        duration: float | None, how long the stage took in seconds ("end" events only)
+        step: int | None, the step that was just completed ("progress" events only)
+        steps: int | None, the total number of steps ("progress" events only)
+        error: bool, whether the stage ended with an exception ("end" events only)
+    """
+    kind: str
+    stage: str
+    time: float
+    duration: float | None
+    step: int | None
+    steps: int | None
+    error: bool
+
+    def __init__(
+            self, 
+            kind: str, 
+            stage: str, 
+            duration: float | None = None, 
+            step: int | None = None, 
+            steps: int | None = None, 
+            error: bool = False
+        ) -> None:
+        self.kind = kind
+        self.stage = stage
+        self.time = time.time()
+        self.duration = duration
+        self.step = step
+        self.steps = steps
+        self.error = error
+
+class ConsoleProgress():
+    """
+    Runner subscriber that prints how long every stage took, and the progress through the steps of a stage.
+    """
+    starts: dict
+
+    def __init__(self) -> None:
+        self.starts = {}
+
+    def __call__(self, event: RunnerEvent):
+        if event.kind == "start":
+            self.starts[event.stage] = event.time
+        elif event.kind == "progress":
+            diff = int(event.time - self.starts.get(event.stage, event.time))
+            print("\r", end="")
+            print(f"{event.stage.capitalize()}: step {event.step}/{event.steps}, "
+                  f"time elapsed: {int(diff/60)} minute(s) and {diff % 60} second(s).", end="")
+            if event.step == event.steps:
+                print()
+        elif event.kind == "end" and event.error:
+            print(f"{event.stage.capitalize()} failed after {event.duration:.2f} s.")
+        elif event.kind == "end":
+            print(f"{event.stage.capitalize()} took {event.duration:.2f} s.")
+
+class TimingRecorder():
+    """
+    Runner subscriber that records the duration of every stage that completed (in the order they ended).
+    Attributes:
+        timings: dict[str, list[float]]
+    """
+    timings: dict[str, list[float]]
+
+    def __init__(self) -> None:
+        self.timings = {}
+
+    def __call__(self, event: RunnerEvent):
+        if event.kind == "end" and not event.error:
+            self.timings.setdefault(event.stage, []).append(event.duration)
+
 class Runner(ABC):
     """
     Abstract class on which all runners (simulations and QPUs) are based upon.
+    Runners emit a RunnerEvent to every subscriber when a stage (circuit build, transpilation, 
+    execution, mitigation, rendering) starts or ends, and as they get through the steps of a stage.
+    A ConsoleProgress subscriber is subscribed by default.
     Attributes:
         lattice: CollisionlessLattice
         dims: tuple | list
         label: str, name of the file without the extension
+        subscribers: list[Callable[[RunnerEvent], None]]
+        save_vti: bool, also write every step to a ".vti" file when visualizing (off by default,
+                  frames are rendered straight from memory)
+        render_processes: int | None, number of processes rendering the frames of an animation
+                          (1 by default, None: one per CPU)
+        animation_format: str, extension of the animation file: "gif" by default, or a video format
+                          such as "mp4" or "webp" (see AnimationWriter)
+        animation_colors: int, palette size of the frames of GIF animations (at most 256)
+        render_backend: str, "pyvista" (default) or "numpy" for quick heatmap previews without PyVista/VTK
     """
     lattice: CollisionlessLattice
     dims: tuple | list
     label: str
+    subscribers: list[Callable[[RunnerEvent], None]]
+    save_vti: bool
+    render_processes: int | None
+    animation_format: str
+    animation_colors: int
+    render_backend: str
 
     def __init__(self):
         super().__init__()
+        self.subscribers = [ConsoleProgress()]
+        self.save_vti = False
+        self.render_processes = 1
+        self.animation_format = "gif"
+        self.animation_colors = 256
+        self.render_backend = "pyvista"
+
+    def subscribe(self, callback: Callable[[RunnerEvent], None]):
+        """
+        Calls "callback" with every RunnerEvent from now on.
+        """
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[RunnerEvent], None]):
+        self.subscribers.remove(callback)
+
+    def emit(self, event: RunnerEvent):
+        for callback in self.subscribers:
+            callback(event)
+
+    @contextmanager
+    def stage(self, stage: str):
+        """
+        Emits the start and end events of a stage around the body of a with statement.
+        The end event is emitted even when the body raises, with its "error" flag set.
+        """
+        self.emit(RunnerEvent("start", stage))
+        start = time.perf_counter()
+        error = True
+        try:
+            yield
+            error = False
+        finally:
+            self.emit(RunnerEvent("end", stage, duration=time.perf_counter() - start, error=error))
+
+    def progress(
+        self, 
+        stage: str, 
+        step: int, 
+        steps: int):
+        """
+        Emits a progress event: "step" of "steps" steps of the stage are done.
+        """
+        self.emit(RunnerEvent("progress", stage, step=step, steps=steps))
 
     @abstractmethod
     def run(
@@ -105,32 +232,42 @@ class Runner(ABC):
 
     def visualize(
         self,
-        counts: list,
+        counts: list | Counts,
         steps: int,
         shots: int = DEFAULT_SHOTS):
         """
-        Visualizes the data in a ".gif" file. Must set self.label to a string first.
+        Visualizes the data in a ".gif" (or self.animation_format) file. Must set self.label to a string first.
+        counts: Counts, or a list of dicts of bitstrings mapped to counts
         """
         if (self.label == ""):
             raise ValueError("self.label cannot be an empty string")
         if (type(self.label) != str):
             raise TypeError("self.label must be a string")
+        output_filename = f"{self.label}_{shots}_shots.{self.animation_format}"
         
-        rmdir_rf(f"vis-output\\{self.label}")
-        create_directory_and_parents(f"vis-output\\{self.label}")
-        
-        resultGen = CollisionlessResult(self.lattice, f"vis-output\\{self.label}")
-        
-        for i in range(steps+1):
-            resultGen.save_timestep_counts(counts[i], i)
-            
-        resultGen.visualize_all_numpy_data()
-
-        create_animation(f"vis-output\\{self.label}\\paraview", f"{self.label}_{shots}_shots.gif")
+        with self.stage("render"):
+            frames = counts_to_frames(self.lattice, as_counts(counts)[:steps+1])
+
+            if self.save_vti:
+                rmdir_rf(f"vis-output\\{self.label}")
+                create_directory_and_parents(f"vis-output\\{self.label}")
+                resultGen = CollisionlessResult(self.lattice, f"vis-output\\{self.label}")
+                for i, frame in enumerate(frames):
+                    resultGen.save_timestep_array(frame, i)
+
+            animate_frames(
+                frames,
+                self.lattice,
+                output_filename,
+                on_frame=lambda i, n: self.progress("render", i, n),
+                num_processes=self.render_processes,
+                colors=self.animation_colors,
+                backend=self.render_backend
+            )
 
         print("done.")
-        print(f"Animation saved as '{self.label}_{shots}_shots.gif'.")
-        return f"{self.label}_{shots}_shots.gif"
+        print(f"Animation saved as '{output_filename}'.")
+        return output_filename
 
     @abstractmethod
     def make(
@@ -148,6 +285,7 @@ class StepCircuit():
     0 steps: only initial conditions and grid measurement.
     n steps: initial conditions, n CQLBM algorithm steps, and then grid measurement.
     In the future, this will become obsolete, when Quantum State Tomography is implemented.
+    To build the circuits of many step counts, use StepCircuitBuilder.circuits instead.
     """
     circuit: QuantumCircuit
     grid_qubits: list[int]
@@ -158,34 +296,307 @@ class StepCircuit():
                  init_cond: None | QuantumCircuit = None, 
                  collision: bool = False
             ) -> None:
+        builder = StepCircuitBuilder.for_lattice(lattice, init_cond=init_cond, collision=collision)
+        self.circuit = builder.circuit(num_steps)
+        self.grid_qubits = builder.grid_qubits
+
+def remove_idle_wires(template: QuantumCircuit, *circuits: QuantumCircuit) -> list[QuantumCircuit]:
+    """
+    Removes the qubits and clbits that are idle in "template" from each of "circuits" (which are 
+    on the same wires as the template).
+    """
+    idle_wires = list(circuit_to_dag(template).idle_wires())
+    idle_qubits = [template.find_bit(wire).index for wire in idle_wires if wire in template.qubits]
+    idle_clbits = [template.find_bit(wire).index for wire in idle_wires if wire in template.clbits]
+
+    reduced = []
+    for circuit in circuits:
+        dag = circuit_to_dag(circuit)
+        dag.remove_qubits(*[dag.qubits[q] for q in idle_qubits])
+        dag.remove_clbits(*[dag.clbits[c] for c in idle_clbits])
+        reduced.append(dag_to_circuit(dag))
+    return reduced
+
+class StepCircuitBuilder():
+    """
+    Builds StepCircuit circuits out of blocks that are only generated once per lattice: the initial 
+    conditions, a single CQLBM (or space-time QLBM) step and the grid measurement. Idle qubits (those
+    that no block acts on) are removed from every block once, so all step counts of 1 and up share 
+    the same qubits, and their circuits are built by appending the step block incrementally.
+    The 0-step circuit is built once on its own, without the qubits that only the step acts on 
+    (e.g. its ancillas), just like a standalone circuit with its idle qubits removed.
+    Builders without custom initial conditions are cached per lattice; see for_lattice().
+    Attributes:
+        init_circuit: QuantumCircuit, the initial conditions
+        step_circuit: QuantumCircuit, a single algorithm step
+        measurement: QuantumCircuit, the grid measurement
+        zero_step_circuit: QuantumCircuit, the initial conditions and grid measurement only
+        grid_qubits: list[int]
+    """
+    init_circuit: QuantumCircuit
+    step_circuit: QuantumCircuit
+    measurement: QuantumCircuit
+    zero_step_circuit: QuantumCircuit
+    grid_qubits: list[int]
+
+    _cache: WeakKeyDictionary = WeakKeyDictionary()
+
+    def __init__(self, 
+                 lattice: CollisionlessLattice | SpaceTimeLattice, 
+                 init_cond: None | QuantumCircuit = None, 
+                 collision: bool = False
+            ) -> None:
         if collision == False:
-            if type(init_cond == None):
-                self.circuit = CollisionlessInitialConditions(lattice).circuit
-            else:
-                self.circuit = init_cond
-            for i in range(0, num_steps):
-                self.circuit.compose(CQLBM(lattice).circuit, inplace=True)
-                # self.circuit.reset([-3,-4,0,1]) # ancilla qubits
-            self.circuit.compose(GridMeasurement(lattice).circuit, inplace=True)
+            init_circuit = CollisionlessInitialConditions(lattice).circuit if init_cond is None else init_cond
+            step_circuit = CQLBM(lattice).circuit
+            measurement = GridMeasurement(lattice).circuit
         else:
-            if type(init_cond == None):
-                self.circuit = SpaceTimeInitialConditions(lattice, grid_data=[((1, 5), (True, True, True, True))]).circuit
+            if init_cond is None:
+                init_circuit = SpaceTimeInitialConditions(lattice, grid_data=[((1, 5), (True, True, True, True))]).circuit
             else:
-                self.circuit = init_cond
-            for i in range(0, num_steps):
-                self.circuit.compose(SpaceTimeQLBM(lattice).circuit, inplace=True)
-            self.circuit.compose(SpaceTimeGridVelocityMeasurement(lattice).circuit, inplace=True)
+                init_circuit = init_cond
+            step_circuit = SpaceTimeQLBM(lattice).circuit
+            measurement = SpaceTimeGridVelocityMeasurement(lattice).circuit
+
+        # Remove idle qubits: the qubits that are idle in a single step circuit are idle in all of them
+        template = init_circuit.compose(step_circuit).compose(measurement)
+        self.init_circuit, self.step_circuit, self.measurement = remove_idle_wires(
+            template, init_circuit, step_circuit, measurement
+        )
+        # Without any step, the qubits that only the step acts on are idle as well
+        zero_step_circuit = init_circuit.compose(measurement)
+        self.zero_step_circuit, = remove_idle_wires(zero_step_circuit, zero_step_circuit)
         
         all_grid_qubits = flatten(
             [lattice.grid_index(dim) for dim in range(lattice.num_dims)]
         )
         self.grid_qubits = [q - 3 for q in all_grid_qubits]
 
-        # Remove idle qubits
-        qprogram = load_program(self.circuit)
-        qprogram.remove_idle_qubits()
-        self.circuit = qprogram.program
+    @classmethod
+    def for_lattice(cls, 
+                    lattice: CollisionlessLattice | SpaceTimeLattice, 
+                    init_cond: None | QuantumCircuit = None, 
+                    collision: bool = False
+            ) -> StepCircuitBuilder:
+        """
+        Gets the builder of a lattice, only generating its blocks the first time.
+        Builders with custom initial conditions are not cached.
+        """
+        if init_cond is not None:
+            return cls(lattice, init_cond=init_cond, collision=collision)
+        builders = cls._cache.setdefault(lattice, {})
+        if collision not in builders:
+            builders[collision] = cls(lattice, collision=collision)
+        return builders[collision]
+
+    @property
+    def measured_qubits(self) -> list[int]:
+        """
+        The qubits measured into classical bits 0, 1, ... (in the circuits of 1 or more steps).
+        """
+        measured = {}
+        for instruction in self.measurement.data:
+            if instruction.operation.name == "measure":
+                clbit = self.measurement.find_bit(instruction.clbits[0]).index
+                measured[clbit] = self.measurement.find_bit(instruction.qubits[0]).index
+        return [measured[clbit] for clbit in sorted(measured)]
+
+    def circuit(self, num_steps: int) -> QuantumCircuit:
+        """
+        Builds the circuit of "num_steps" steps.
+        """
+        if num_steps == 0:
+            return self.zero_step_circuit.copy()
+        circuit = self.init_circuit.copy()
+        for i in range(0, num_steps):
+            circuit.compose(self.step_circuit, inplace=True)
+        circuit.compose(self.measurement, inplace=True)
+        return circuit
+
+    def circuits(self, steps: int) -> list[QuantumCircuit]:
+        """
+        Builds the circuits of 0 up to (and including) "steps" steps.
+        """
+        circuits = [self.zero_step_circuit.copy()]
+        body = self.init_circuit.copy()
+        for i in range(0, steps):
+            body.compose(self.step_circuit, inplace=True)
+            circuits.append(body.compose(self.measurement))
+        return circuits
      
+class TranspilationCache():
+    """
+    An on-disk cache of transpiled circuits (as .qpy files), so that repeat runs, re-visualizations
+    and ZNE skip transpilation. Entries are keyed by a structural hash of the logical circuit, a 
+    fingerprint of the backend target (including its error rates, which layout selection depends 
+    on), the pass manager settings and the Qiskit version.
+    Job IDs are mapped to the entries of the circuits they ran, so a job is re-visualized with 
+    exactly those circuits (and their layout) even after the backend was recalibrated.
+    Attributes:
+        directory: str
+        num_processes: int | None, the number of processes that circuits missing from the cache are 
+            transpiled in parallel with (None: Qiskit's default, i.e. every CPU)
+        jobs: dict[str, list[str]], the entry keys of the circuits of every recorded job
+    """
+    directory: str
+    num_processes: int | None
+    jobs: dict[str, list[str]]
+
+    def __init__(
+        self, 
+        directory: str = "transpile-cache", 
+        num_processes: int | None = None
+        ) -> None:
+        self.directory = directory
+        self.num_processes = num_processes
+        self.jobs = {}
+        if path.exists(f"{directory}/jobs.json"):
+            with open(f"{directory}/jobs.json", "r") as file:
+                self.jobs = json.load(file)
+
+    @staticmethod
+    def circuit_hash(circuit: QuantumCircuit) -> str:
+        """
+        Hashes the structure of a circuit: every instruction's name, size, parameters and bits.
+        Gates outside Qiskit's standard gate library (custom and composite gates) are also hashed 
+        by their definition, recursively, so two gates of the same name and size but with different 
+        contents never share a cache entry.
+        """
+        standard_gates = get_standard_gate_name_mapping()
+        # Definitions shared by several instructions (e.g. repeated steps) are only hashed once
+        definition_hashes = {}
+
+        def structure_hash(circuit: QuantumCircuit) -> str:
+            h = hashlib.sha256(repr((circuit.num_qubits, circuit.num_clbits)).encode())
+            for instruction in circuit.data:
+                op = instruction.operation
+                base_gate = getattr(op, "base_gate", None)
+                h.update(repr((
+                    op.name, 
+                    op.num_qubits, 
+                    op.num_clbits, 
+                    [str(param) for param in op.params],
+                    base_gate.name if base_gate is not None else None,
+                    getattr(op, "ctrl_state", None),
+                    [circuit.find_bit(qubit).index for qubit in instruction.qubits],
+                    [circuit.find_bit(clbit).index for clbit in instruction.clbits],
+                    definition_hash(op),
+                )).encode())
+            return h.hexdigest()
+
+        def definition_hash(op) -> str | None:
+            standard = standard_gates.get(op.name)
+            if standard is not None and type(op) is type(standard):
+                return None
+            if id(op) not in definition_hashes:
+                definition = getattr(op, "definition", None)
+                definition_hashes[id(op)] = None if definition is None else structure_hash(definition)
+            return definition_hashes[id(op)]
+
+        return structure_hash(circuit)
+
+    @staticmethod
+    def target_hash(backend) -> str:
+        """
+        Fingerprints the target of a backend: its name, qubits, operations, and their errors and durations.
+        """
+        target = backend.target
+        h = hashlib.sha256(repr((backend.name, target.num_qubits, target.dt)).encode())
+        for name in sorted(target.operation_names):
+            for qargs, props in target[name].items():
+                h.update(repr((
+                    name, 
+                    qargs, 
+                    None if props is None else (props.error, props.duration)
+                )).encode())
+        return h.hexdigest()
+
+    def keys(
+        self, 
+        circuits: list[QuantumCircuit], 
+        backend, 
+        transform_key: str = "",
+        **settings
+        ) -> list[str]:
+        """
+        The cache keys of the circuits, transpiled for the backend with the given settings (see run).
+        """
+        prefix = f"{self.target_hash(backend)}{sorted(settings.items())}{transform_key}{qiskit.__version__}"
+        return [hashlib.sha256((prefix + self.circuit_hash(qc)).encode()).hexdigest() for qc in circuits]
+
+    def record_job(
+        self, 
+        job_id: str, 
+        keys: list[str]
+        ):
+        """
+        Records the cache keys of the circuits a job ran, in order.
+        """
+        self.jobs[job_id] = list(keys)
+        create_directory_and_parents(self.directory)
+        with open(f"{self.directory}/jobs.json", "w") as file:
+            json.dump(self.jobs, file)
+
+    def load_job(self, job_id: str) -> list[QuantumCircuit] | None:
+        """
+        Loads the transpiled circuits a recorded job ran, without transpiling anything.
+        Returns None if the job was not recorded or one of its entries is missing.
+        """
+        keys = self.jobs.get(job_id)
+        if keys is None or not all(path.exists(f"{self.directory}/{key}.qpy") for key in keys):
+            return None
+        circuits = []
+        for key in keys:
+            with open(f"{self.directory}/{key}.qpy", "rb") as file:
+                circuits.append(qpy.load(file)[0])
+        return circuits
+
+    def run(
+        self, 
+        circuits: list[QuantumCircuit], 
+        backend, 
+        transform: Callable[[QuantumCircuit], QuantumCircuit] | None = None,
+        transform_key: str = "",
+        keys: list[str] | None = None,
+        **settings
+        ) -> list[QuantumCircuit]:
+        """
+        Transpiles the circuits with generate_preset_pass_manager(backend=backend, **settings), 
+        loading every circuit that was already transpiled with the same target and settings 
+        from the cache instead.
+        transform: (optional) applied to every circuit that is not in the cache before transpiling it
+            (e.g. gate folding); must be deterministic, and is told apart by "transform_key"
+        keys: (optional) the cache keys of the circuits, if already computed with keys()
+        """
+        if keys is None:
+            keys = self.keys(circuits, backend, transform_key, **settings)
+        
+        transpiled = [None] * len(circuits)
+        misses = []
+        for i, key in enumerate(keys):
+            if path.exists(f"{self.directory}/{key}.qpy"):
+                with open(f"{self.directory}/{key}.qpy", "rb") as file:
+                    transpiled[i] = qpy.load(file)[0]
+            else:
+                misses.append(i)
+
+        if misses:
+            pass_manager = generate_preset_pass_manager(backend=backend, **settings)
+            create_directory_and_parents(self.directory)
+            if transform is None:
+                transform = lambda qc: qc
+            # PassManager.run returns the circuits in order, however many processes transpile them
+            exec_circuits = pass_manager.run(
+                [transform(circuits[i]) for i in misses], 
+                num_processes=self.num_processes
+            )
+            for i, qc in zip(misses, exec_circuits):
+                transpiled[i] = qc
+                with open(f"{self.directory}/{keys[i]}.qpy", "wb") as file:
+                    qpy.dump(qc, file)
+
+        return transpiled
+
 class Lattice(CollisionlessLattice):
     """
     Since practical implementations of QLBM will be done on collisionless lattices, 
@@ -205,6 +616,188 @@ class Lattice(CollisionlessLattice):
         )
         self.dims = dims
 
+class Counts:
+    """
+    Compact, array-backed measurement counts, with one entry per timestep (or per circuit).
+    Rather than a dict of bitstrings, every entry holds the outcomes it observed as integers
+    (Qiskit ordering, i.e. int(bitstring, 2)) and their counts, as two numpy arrays.
+    Indexing or iterating over it still gives dicts of bitstrings, so code written for
+    list[dict] keeps working.
+    Attributes:
+        indices: list[np.ndarray], observed outcomes of every entry
+        values: list[np.ndarray], counts of those outcomes
+        num_bits: int, number of measured bits
+    """
+    indices: list[np.ndarray]
+    values: list[np.ndarray]
+    num_bits: int
+
+    def __init__(
+            self,
+            indices: list[np.ndarray],
+            values: list[np.ndarray],
+            num_bits: int
+        ) -> None:
+        self.indices = [np.asarray(idx, dtype=np.int64) for idx in indices]
+        self.values = [np.asarray(val) for val in values]
+        self.num_bits = num_bits
+
+    @classmethod
+    def from_dicts(
+            cls,
+            counts: list[dict],
+            num_bits: int | None = None
+        ) -> Counts:
+        """
+        Parses dicts of bitstrings mapped to counts, all keys of a dict at once.
+        """
+        if num_bits is None:
+            num_bits = next(len(key) for count in counts for key in count)
+        weights = 1 << np.arange(num_bits - 1, -1, -1, dtype=np.int64)
+        indices, values = [], []
+        for count in counts:
+            keys = "".join(count.keys()).encode("ascii")
+            bits = np.frombuffer(keys, dtype=np.uint8).reshape(len(count), num_bits) - ord("0")
+            indices.append(bits.astype(np.int64) @ weights)
+            values.append(np.array(list(count.values())) if count else np.zeros(0, dtype=np.int64))
+        return cls(indices, values, num_bits)
+
+    @classmethod
+    def from_int_dicts(
+            cls,
+            counts: list[dict],
+            num_bits: int
+        ) -> Counts:
+        """
+        Takes dicts of integer outcomes mapped to counts (e.g. Qiskit's ProbDistribution or get_int_counts()).
+        """
+        return cls(
+            [np.fromiter(count.keys(), dtype=np.int64, count=len(count)) for count in counts],
+            [np.array(list(count.values())) if count else np.zeros(0) for count in counts],
+            num_bits
+        )
+
+    @classmethod
+    def from_bit_arrays(cls, bit_arrays: list) -> Counts:
+        """
+        Counts the shots of Qiskit BitArrays (one per circuit, e.g. result[i].join_data())
+        straight from their packed bytes.
+        """
+        indices, values = [], []
+        for bit_array in bit_arrays:
+            packed = bit_array.array.reshape(-1, bit_array.array.shape[-1]).astype(np.int64)
+            shifts = 8 * np.arange(packed.shape[1] - 1, -1, -1, dtype=np.int64)
+            idx, val = np.unique((packed << shifts).sum(axis=1), return_counts=True)
+            indices.append(idx)
+            values.append(val)
+        return cls(indices, values, bit_arrays[0].num_bits)
+
+    @classmethod
+    def from_dense(
+            cls,
+            dense: np.ndarray,
+            reverse: bool = False,
+            tol: float | None = None
+        ) -> Counts:
+        """
+        Takes a [entries, 2^num_bits] (or [entries, 2^num_bits, 1]) array of counts or probabilities.
+        reverse: bool, the vectors index bitstrings in reverse order, as PyIBU does
+        tol: float, only keep outcomes above tol (keeps all outcomes by default)
+        """
+        dense = np.asarray(dense).reshape(len(dense), -1)
+        num_bits = int(log2(dense.shape[1]))
+        indices, values = [], []
+        for vec in dense:
+            idx = np.arange(len(vec)) if tol is None else np.flatnonzero(vec > tol)
+            values.append(vec[idx])
+            indices.append(reverse_bits(idx, num_bits) if reverse else idx)
+        return cls(indices, values, num_bits)
+
+    @classmethod
+    def concatenate(cls, counts: list[Counts]) -> Counts:
+        """
+        Joins the entries of several Counts (over the same number of bits).
+        """
+        return cls(
+            [idx for count in counts for idx in count.indices],
+            [val for count in counts for val in count.values],
+            counts[0].num_bits
+        )
+
+    def scaled(self, shots: int) -> Counts:
+        """
+        Turns probabilities into counts, truncating them like int(prob * shots).
+        """
+        return Counts(self.indices, [(val * shots).astype(np.int64) for val in self.values], self.num_bits)
+
+    def bitstrings(self, i: int) -> list[str]:
+        """
+        Gets the bitstrings of the outcomes of entry i.
+        """
+        if len(self.indices[i]) == 0:
+            return []
+        shifts = np.arange(self.num_bits - 1, -1, -1, dtype=np.int64)
+        chars = ((self.indices[i][:, None] >> shifts) & 1).astype(np.uint8) + ord("0")
+        return chars.view(f"S{self.num_bits}").ravel().astype(str).tolist()
+
+    def to_dict(self, i: int) -> dict:
+        """
+        Gets entry i as a dict of bitstrings mapped to counts.
+        """
+        return dict(zip(self.bitstrings(i), self.values[i].tolist()))
+
+    def to_dicts(self) -> list[dict]:
+        return [self.to_dict(i) for i in range(len(self))]
+
+    def to_dense(
+            self,
+            i: int,
+            reverse: bool = False
+        ) -> np.ndarray:
+        """
+        Gets entry i as a 2^num_bits vector of counts.
+        reverse: bool, index bitstrings in reverse order, as PyIBU does
+        """
+        vec = np.zeros(2 ** self.num_bits, dtype=self.values[i].dtype)
+        idx = reverse_bits(self.indices[i], self.num_bits) if reverse else self.indices[i]
+        vec[idx] = self.values[i]
+        return vec
+
+    def dense(self, reverse: bool = False) -> np.ndarray:
+        """
+        Gets all entries as a [entries, 2^num_bits] array of counts.
+        """
+        return np.stack([self.to_dense(i, reverse=reverse) for i in range(len(self))])
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return Counts(self.indices[i], self.values[i], self.num_bits)
+        return self.to_dict(i)
+
+    def __iter__(self):
+        return (self.to_dict(i) for i in range(len(self)))
+
+def as_counts(counts: list[dict] | Counts) -> Counts:
+    """
+    Takes counts as either a Counts or a list of dicts of bitstrings mapped to counts.
+    """
+    if isinstance(counts, Counts):
+        return counts
+    return Counts.from_dicts(counts)
+
+def reverse_bits(indices: np.ndarray, num_bits: int) -> np.ndarray:
+    """
+    Reverses the bit order of integer outcomes, i.e. int(bitstring, 2) <-> int(bitstring[::-1], 2).
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    reversed_indices = np.zeros_like(indices)
+    for b in range(num_bits):
+        reversed_indices |= ((indices >> b) & 1) << (num_bits - 1 - b)
+    return reversed_indices
+
 def rmdir_rf(dir: str):
     """
     Recursively forces the removal of an entire directory.
@@ -214,88 +807,133 @@ def rmdir_rf(dir: str):
     except OSError:
         pass
 
-def create_animation(simdir: str, output_filename: str):
+@lru_cache(maxsize=None)
+def grid_cell_index(
+        num_gridpoints: tuple,
+        num_bits: int
+    ) -> np.ndarray:
+    """
+    Maps every integer outcome (Qiskit ordering) of a num_bits measurement to the flat index
+    of its cell in a (num_gridpoints[0]+1, num_gridpoints[1]+1) grid, following the layout of
+    CollisionlessResult.save_timestep_counts: x is read from the leading bits, y from the next ones.
+    """
+    bits_x, bits_y = (n.bit_length() for n in num_gridpoints)
+    outcomes = np.arange(2 ** num_bits, dtype=np.int64)
+    x = (outcomes >> (num_bits - bits_x)) & ((1 << bits_x) - 1)
+    y = (outcomes >> (num_bits - bits_x - bits_y)) & ((1 << bits_y) - 1)
+    return x * (num_gridpoints[1] + 1) + y
+
+def counts_to_frames(
+        lattice: CollisionlessLattice,
+        counts: list[dict] | Counts
+    ) -> np.ndarray:
+    """
+    Turns the counts of every step into a [steps, x, y] array of measurements at every gridpoint
+    of a 2D lattice, the same arrays CollisionlessResult writes to its ".vti" files.
+    """
+    counts = as_counts(counts)
+    num_gridpoints = tuple(lattice.num_gridpoints[:2])
+    cell_index = grid_cell_index(num_gridpoints, counts.num_bits)
+    num_cells = (num_gridpoints[0] + 1) * (num_gridpoints[1] + 1)
+    frames = np.stack([
+        np.bincount(cell_index[idx], weights=val, minlength=num_cells) for idx, val in zip(counts.indices, counts.values)
+    ])
+    return frames.reshape(len(counts), num_gridpoints[0] + 1, num_gridpoints[1] + 1)
+
+def geometry_mesh(lattice: CollisionlessLattice):
+    """
+    Gets the obstacles of a lattice as a PyVista MultiBlock, without going through ".stl" files.
+    """
+    import pyvista as pv
+
+    meshes = pv.MultiBlock()
+    for block in flatten(lattice.blocks.values()):
+        vectors = block.stl_mesh().vectors
+        faces = np.arange(3 * len(vectors)).reshape(-1, 3)
+        meshes.append(pv.PolyData(
+            vectors.reshape(-1, 3),
+            np.hstack([np.full((len(faces), 1), 3), faces]).ravel()
+        ))
+    return meshes
+
+def animate_frames(
+        frames: np.ndarray,
+        lattice: CollisionlessLattice,
+        output_filename: str,
+        on_frame: Callable[[int, int], None] | None = None,
+        num_processes: int | None = 1,
+        colors: int = 256,
+        backend: str = "pyvista"
+    ):
+    """
+    Creates a PyVista animation straight from [steps, x, y] arrays (see counts_to_frames).
+    num_processes, colors: see render_animation
+    backend: str, "pyvista", or "numpy" for a heatmap preview (see render_preview; obstacles are not drawn)
+    """
+    if backend not in RENDER_BACKENDS:
+        raise ValueError(f"backend must be one of {RENDER_BACKENDS}")
+
+    # Same (C order) point layout as the ".vti" files of CollisionlessResult
+    scalars = frames.reshape(len(frames), -1).astype(np.float32)
+    if backend == "numpy":
+        render_preview(scalars, frames.shape[1:], output_filename, on_frame=on_frame, colors=colors)
+        return
+
+    import pyvista as pv
+
+    grid = pv.ImageData(dimensions=(frames.shape[1], frames.shape[2], 1))
+    render_animation(
+        grid, scalars, geometry_mesh(lattice), output_filename, on_frame=on_frame, num_processes=num_processes, colors=colors
+    )
+
+def create_animation(
+        simdir: str,
+        output_filename: str,
+        num_processes: int | None = 1,
+        colors: int = 256,
+        backend: str = "pyvista"
+    ):
     """
     Creates a PyVista animation given the directory in which simulation '.vti' files are stored.
-    (NOT MY WORK: credit to QLBM)
+    num_processes, colors: see render_animation
+    backend: str, see animate_frames; the "numpy" backend reads the '.vti' files with VTK directly, 
+        without PyVista
     """
+    if backend not in RENDER_BACKENDS:
+        raise ValueError(f"backend must be one of {RENDER_BACKENDS}")
+
     vti_files = sorted(
         [f"{simdir}/{fname}" for fname in listdir(simdir) if fname.endswith(".vti")]
     )
+
+    if backend == "numpy":
+        import vtk
+        from vtk.util.numpy_support import vtk_to_numpy
+
+        reader = vtk.vtkXMLImageDataReader()
+        scalars = []
+        for vti_file in vti_files:
+            reader.SetFileName(vti_file)
+            reader.Update()
+            scalars.append(vtk_to_numpy(reader.GetOutput().GetPointData().GetScalars()).copy())
+        render_preview(scalars, reader.GetOutput().GetDimensions(), output_filename, colors=colors)
+        return
+
+    import pyvista as pv
+
     stl_mesh = pv.read(
         [f"{simdir}/{fname}" for fname in listdir(simdir) if fname.endswith(".stl")]
     )
 
-    # Find the global maximum scalar value
-    max_scalar = 0
+    # Every file is read once; the grid of the first one is reused for all frames
+    grid = None
+    scalars = []
     for vti_file in vti_files:
         mesh = pv.read(vti_file)
-        if mesh.active_scalars is not None:
-            max_scalar = max(max_scalar, mesh.active_scalars.max())
-
-    images = []
-    sargs = dict(
-        title="Measurements at gridpoint",
-        title_font_size=20,
-        label_font_size=16,
-        shadow=True,
-        n_labels=3,
-        italic=True,
-        fmt="%.1f",
-        font_family="arial",
-        position_x=0.2,  # Centering the scalar bar
-        position_y=0.05,
-    )
-
-    images = []
-    for c, vti_file in enumerate(vti_files):
-        time_step_mesh = pv.read(vti_file)
-
-        plotter = pv.Plotter(off_screen=True)
-        plotter.add_mesh(
-            time_step_mesh,
-            clim=[0, max_scalar],
-            show_edges=True,
-            scalar_bar_args=sargs,
-        )
-
-        plotter.add_mesh(
-            stl_mesh,
-            show_scalar_bar=False,
-        )
-        plotter.view_xy()
-        img = plotter.screenshot(
-            transparent_background=True,
-        )
-        images.append(img)
-
-        # Clean up the plotter
-        plotter.close()
-
-        # Convert screenshot to PIL image
-        pil_img = Image.fromarray(img)
-        draw = ImageDraw.Draw(pil_img)
-
-        # Draw progress bar
-        bar_width = int(pil_img.width * 0.8)
-        bar_height = 20
-        bar_x = (pil_img.width - bar_width) // 2
-        bar_y = pil_img.height - 40
-        progress = int((c + 1) / (len(vti_files)) * bar_width)
-
-        draw.rectangle(
-            [bar_x, bar_y, bar_x + bar_width, bar_y + bar_height],
-            outline="black",
-            width=3,
-        )
-        draw.rectangle(
-            [bar_x, bar_y, bar_x + progress, bar_y + bar_height], fill="purple"
-        )
-
-        images.append(np.array(pil_img))
+        grid = mesh if grid is None else grid
+        scalars.append(np.array(mesh.active_scalars))
 
-    # Create the GIF from the collected images
-    imageio.mimsave(output_filename, images, duration=6, loop=0)
+    render_animation(grid, scalars, stl_mesh, output_filename, num_processes=num_processes, colors=colors)
 
 def generate_bitstrings(n: int) -> list[str]:
     bitstrings = []
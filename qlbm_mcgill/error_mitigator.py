@@ -1,44 +1,444 @@
+from __future__ import annotations
 from base import *
-from mitiq import zne
-from mitiq.interface.mitiq_qiskit.qiskit_utils import initialized_depolarizing_noise
+from typing import TYPE_CHECKING
+
+from qiskit_ibm_runtime import QiskitRuntimeService, IBMBackend
+from qiskit_ibm_runtime import SamplerV2 as Sampler
+
+# PyIBU imports
+# Credit: https://github.com/sidsrinivasan/PyIBU
+from ibu_utils.qc_utils import get_response_matrix_from_dict
+from collections import OrderedDict
+from datetime import datetime
+
+# qiskit_experiments, mitiq and PyIBU (tensorflow/jax) are imported by the methods that use them
+if TYPE_CHECKING:
+    from qiskit_experiments.library import CorrelatedReadoutError, LocalReadoutError
+    from qiskit_experiments.data_processing import CorrelatedReadoutMitigator, LocalReadoutMitigator
+    from ibu_src.IBUFull import IBUFull
+    from ibu_src.IBUReduced import IBUReduced
 
 class REMTable:
     """
-    A lookup table for Readout Error Mitigation (REM) experiment data, to save on QPU time.
+    A lookup table for Readout Error Mitigation (REM) experiments, to save on QPU time.
+    Entries hold the fitted assignment matrices of an experiment (the full matrix of a 
+    CorrelatedReadoutError, the stacked 2x2 matrices of a LocalReadoutError) as a .npz file, along 
+    with the measured qubits, the backend calibration they were measured under and the experiment
+    time, so loading them never re-runs the analysis.
+    Entries are kept in memory as well (least recently used entries are evicted past "max_entries"),
+    and are considered stale once the backend was recalibrated, they are older than "max_age" hours
+    (None: never too old) or were measured on other qubits.
     """
     service: QiskitRuntimeService
+    directory: str
+    max_entries: int
+    max_age: float | None
+    entries: OrderedDict
 
-    def __init__(self, service):
+    def __init__(
+        self, 
+        service: QiskitRuntimeService, 
+        directory: str = "rem-table", 
+        max_entries: int = 8, 
+        max_age: float | None = 24
+        ) -> None:
         self.service = service
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.entries = OrderedDict()
+
+    def filename(
+        self, 
+        backend_name: str, 
+        dims: list | tuple, 
+        local: bool = False, 
+        extension: str = "npz"
+        ) -> str:
+        """
+        The file of a REM experiment; LocalReadoutError experiments get a "_local" suffix.
+        """
+        return f"{self.directory}/{backend_name}_{dims[0]}x{dims[1]}{'_local' if local else ''}.{extension}"
 
     def enter(
         self, 
         dims: list | tuple, 
-        job_id: str
+        backend_name: str, 
+        qubits: list[int], 
+        matrices: np.ndarray, 
+        job_id: str, 
+        calibration: str, 
+        local: bool = False
         ):
         """
-        Enter a REM experiment into the table by dumping its contents into a .json file.
+        Enter the fitted assignment matrices of a REM experiment into the table and save them to a
+        .npz file, along with the backend calibration they were measured under (as given by 
+        ResponseMatrixTable.calibration, so both tables share one calibration key).
         """
-        job = self.service.job(job_id)
-        with open(f"rem-table/{job.backend().name}_{dims[0]}x{dims[1]}.json", "w") as file:
-            json.dump((job.result(), job_id), file, cls=RuntimeEncoder)
+        entry = {
+            "matrices": np.asarray(matrices, dtype=float),
+            "qubits": np.asarray(qubits, dtype=int),
+            "calibration": np.str_(calibration),
+            "time": np.float64(time.time()),
+            "job_id": np.str_(job_id),
+        }
+        create_directory_and_parents(self.directory)
+        np.savez(self.filename(backend_name, dims, local), **entry)
+        self.cache(self.filename(backend_name, dims, local), entry)
 
     def load(
         self, 
         dims: list | tuple, 
-        backend: IBMBackend,
-        exp: CorrelatedReadoutError
+        backend_name: str, 
+        qubits: list[int], 
+        calibration: str, 
+        local: bool = False
+        ) -> np.ndarray | None:
+        """
+        Load the assignment matrices of a REM experiment, from memory if possible, else from disk.
+        Returns None if the table has no fresh entry for the backend, lattice, qubits and current
+        backend calibration.
+        """
+        key = self.filename(backend_name, dims, local)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            entry = self.entries[key]
+        elif path.exists(key):
+            with np.load(key) as file:
+                entry = {name: file[name] for name in file.files}
+            self.cache(key, entry)
+        else:
+            return None
+
+        if self.stale(entry, qubits, calibration):
+            return None
+        return entry["matrices"]
+
+    def stale(
+        self, 
+        entry: dict, 
+        qubits: list[int], 
+        calibration: str
+        ) -> bool:
+        """
+        Whether an entry was measured on other qubits or under another backend calibration, or is
+        too old to use.
+        """
+        if list(entry["qubits"]) != list(qubits):
+            return True
+        if "time" not in entry or str(entry["calibration"]) != calibration:
+            return True
+        return self.max_age is not None and time.time() - float(entry["time"]) > 3600 * self.max_age
+
+    def cache(
+        self, 
+        key: str, 
+        entry: dict
+        ):
+        """
+        Keeps an entry in memory, evicting the least recently used entry when the table is full.
+        """
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+class ResponseMatrixTable:
+    """
+    A lookup table for the single-qubit readout response matrices used by IBU, to save on backend
+    property calls. Entries are keyed by backend name and calibration time, hold the 
+    (prob_meas1_prep0, prob_meas0_prep1) pair of every qubit as one compact array, and are kept in 
+    memory (least recently used entries are evicted past "max_entries") as well as on disk.
+    Job IDs are mapped to the calibration they ran under, so re-mitigating an archived job makes
+    no backend property calls at all. The current calibration of a backend is fetched again once
+    it is older than "max_age" hours (None: only on refresh()).
+    """
+    directory: str
+    max_entries: int
+    max_age: float | None
+    entries: OrderedDict
+    calibrations: dict
+    jobs: dict
+
+    def __init__(
+        self, 
+        directory: str = "response-table", 
+        max_entries: int = 8, 
+        max_age: float | None = 1
+        ) -> None:
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.entries = OrderedDict()
+        self.calibrations = {}
+        self.jobs = {}
+        if path.exists(f"{directory}/jobs.json"):
+            with open(f"{directory}/jobs.json", "r") as file:
+                self.jobs = json.load(file)
+
+    def calibration(
+        self, 
+        backend: IBMBackend, 
+        job_id: str | None = None
+        ) -> str:
+        """
+        Gets the current calibration time of the backend, or the calibration a job ran under.
+        A job's calibration is resolved from the backend properties at the job's creation date 
+        (not the current ones, which may have changed since), then recorded in the table.
+        """
+        if job_id is not None:
+            if job_id not in self.jobs:
+                job = backend.service.job(job_id)
+                self.jobs[job_id] = self.fetch(backend, job.creation_date)
+                create_directory_and_parents(self.directory)
+                with open(f"{self.directory}/jobs.json", "w") as file:
+                    json.dump(self.jobs, file)
+            return self.jobs[job_id]
+
+        fetched = self.calibrations.get(backend.name)
+        if fetched is None or (self.max_age is not None and time.time() - fetched[1] > 3600 * self.max_age):
+            self.calibrations[backend.name] = (self.fetch(backend), time.time())
+        return self.calibrations[backend.name][0]
+
+    def fetch(
+        self, 
+        backend: IBMBackend, 
+        date: datetime | None = None
+        ) -> str:
+        """
+        Fetches the backend properties (the latest ones before "date", or the current ones) and returns 
+        their calibration time. Calibrations that are not in the table yet are entered into it.
+        """
+        if date is None:
+            prop = backend.properties(refresh=True)
+        else:
+            prop = backend.properties(datetime=date)
+        calibration = prop.last_update_date.strftime("%Y%m%dT%H%M%S")
+        if not path.exists(f"{self.directory}/{backend.name}_{calibration}.npy"):
+            self.enter(backend.name, calibration, prop.__dict__)
+        return calibration
+
+    def refresh(self):
+        """
+        Forgets the current calibration of every backend, so the next lookup fetches it again
+        (regardless of max_age).
+        """
+        self.calibrations = {}
+
+    def enter(
+        self, 
+        backend_name: str, 
+        calibration: str, 
+        prop: dict
         ):
         """
-        Load REM experiment results from the corresponding .json file.
+        Enter the readout error probabilities of every qubit of a backend property dict into the 
+        table and save them to a .npy file.
         """
-        with open(f"rem-table/{backend.name}_{dims[0]}x{dims[1]}.json", "r") as file:
-            raw, job_id = json.load(file, cls=RuntimeDecoder)
-            data = ExperimentData(experiment=exp)
-            data._add_result_data(raw, job_id)
-            result = exp.analysis.run(data)
+        probs = np.full((len(prop["_qubits"]), 2), np.nan)
+        for q in range(len(prop["_qubits"])):
+            try:
+                mat = get_response_matrix_from_dict(prop, q)
+                probs[q] = [mat[1, 0], mat[0, 1]]
+            except KeyError:
+                pass # qubit without readout calibration data
+        create_directory_and_parents(self.directory)
+        np.save(f"{self.directory}/{backend_name}_{calibration}.npy", probs)
+        self.cache((backend_name, calibration), probs)
 
-        return result
+    def load(
+        self, 
+        backend_name: str, 
+        calibration: str
+        ) -> np.ndarray:
+        """
+        Load the readout error probabilities of a calibration, from memory if possible, else from disk.
+        """
+        key = (backend_name, calibration)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        probs = np.load(f"{self.directory}/{backend_name}_{calibration}.npy")
+        self.cache(key, probs)
+        return probs
+
+    def cache(
+        self, 
+        key: tuple, 
+        probs: np.ndarray
+        ):
+        """
+        Keeps an entry in memory, evicting the least recently used entry when the table is full.
+        """
+        self.entries[key] = probs
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def matrices(
+        self, 
+        backend: IBMBackend, 
+        qubits: list[int], 
+        job_id: str | None = None
+        ) -> list[np.ndarray]:
+        """
+        Gets the 2x2 response matrices of the given qubits, in the same format as get_response_matrix.
+        Raises a ValueError if a qubit has no readout calibration data.
+        """
+        calibration = self.calibration(backend, job_id)
+        probs = self.load(backend.name, calibration)
+        missing = [q for q in qubits if np.isnan(probs[q]).any()]
+        if missing:
+            raise ValueError(f"No readout calibration data for qubit(s) {missing} of {backend.name} "
+                             f"(calibration {calibration})")
+        return [np.array([[1-probs[q, 0], probs[q, 1]], [probs[q, 0], 1-probs[q, 1]]]) for q in qubits]
+
+class BlockReadoutModel:
+    """
+    A readout error model made of small blocks of qubits with correlated readout errors (e.g. 
+    neighbouring pairs or triples), independent of one another. The full 2^N x 2^N assignment matrix
+    is the Kronecker product of the blocks' 2^b x 2^b matrices, so it is never built: it is applied
+    with block_kron_matmul from ibu_src/kron_matmul.py, for inversion as well as for IBU. Calibrating
+    it takes 2^b circuits (all blocks are prepared in the same basis state at once) instead of 2^N.
+    Qubits are referred to by their measured bit (qubit i is measured into classical bit i).
+    Attributes:
+        blocks: list[list[int]], the measured bits of every block
+        matrices: list[np.ndarray], the assignment matrix of every block: entry [i, j] is the 
+            probability of reading block state i when block state j was prepared (the first bit of 
+            the block being the most significant)
+    """
+    blocks: list[list[int]]
+    matrices: list[np.ndarray]
+
+    def __init__(
+        self, 
+        blocks: list[list[int]], 
+        matrices: list[np.ndarray]
+        ) -> None:
+        self.blocks = [list(block) for block in blocks]
+        self.matrices = [np.asarray(mat) for mat in matrices]
+
+    @classmethod
+    def tensored(cls, matrices: list[np.ndarray]) -> BlockReadoutModel:
+        """
+        The uncorrelated (tensored) model: every qubit is its own block, with its 2x2 response matrix
+        (e.g. from LocalReadoutError or get_response_matrix), given in the order of the measured bits.
+        """
+        return cls([[bit] for bit in range(len(matrices))], matrices)
+
+    @staticmethod
+    def neighbour_blocks(
+        num_qubits: int, 
+        size: int = 2
+        ) -> list[list[int]]:
+        """
+        Groups consecutive measured bits into blocks of (at most) "size" qubits.
+        """
+        return [list(range(i, min(i + size, num_qubits))) for i in range(0, num_qubits, size)]
+
+    @property
+    def num_qubits(self) -> int:
+        return sum(len(block) for block in self.blocks)
+
+    def block_states(
+        self, 
+        indices: np.ndarray, 
+        block: list[int]
+        ) -> np.ndarray:
+        """
+        Gets the state of a block in every one of the given integer outcomes.
+        """
+        states = np.zeros_like(indices)
+        for t, bit in enumerate(block):
+            states |= ((indices >> bit) & 1) << (len(block) - 1 - t)
+        return states
+
+    def calibration_circuits(self, qubits: list[int]) -> list[QuantumCircuit]:
+        """
+        Creates the calibration circuits: circuit k prepares every block in basis state k 
+        (modulo the size of the block) and measures qubits[i] into classical bit i.
+        """
+        circuits = []
+        for k in range(2 ** max(len(block) for block in self.blocks)):
+            qc = QuantumCircuit(max(qubits) + 1, len(qubits))
+            for block in self.blocks:
+                state = k % 2 ** len(block)
+                for t, bit in enumerate(block):
+                    if (state >> (len(block) - 1 - t)) & 1:
+                        qc.x(qubits[bit])
+            qc.measure(qubits, list(range(len(qubits))))
+            circuits.append(qc)
+        return circuits
+
+    @classmethod
+    def from_calibration(
+        cls, 
+        blocks: list[list[int]], 
+        counts: Counts
+        ) -> BlockReadoutModel:
+        """
+        Fits the block assignment matrices to the counts of the calibration circuits.
+        """
+        model = cls(blocks, [np.zeros((2 ** len(block), 2 ** len(block))) for block in blocks])
+        for k in range(len(counts)):
+            for block, mat in zip(model.blocks, model.matrices):
+                measured = model.block_states(counts.indices[k], block)
+                mat[:, k % len(mat)] += np.bincount(measured, weights=counts.values[k], minlength=len(mat))
+        model.matrices = [mat / mat.sum(axis=0, keepdims=True) for mat in model.matrices]
+        return model
+
+    def matmul(
+        self, 
+        vecs: np.ndarray, 
+        inverse: bool = False
+        ) -> np.ndarray:
+        """
+        Multiplies the assignment matrix (or its inverse) with a 2^N x K array of vectors, 
+        indexed in PyIBU's (reversed) bit order.
+        """
+        from ibu_src.kron_matmul import block_kron_matmul
+
+        ops = [np.linalg.inv(mat) for mat in self.matrices] if inverse else self.matrices
+        return block_kron_matmul(tuple(tuple(block) for block in self.blocks), ops, vecs, np)
+
+    def mitigate(self, counts: list | Counts) -> Counts:
+        """
+        Mitigates the readout error of every entry at once by inverting the assignment matrix; the
+        resulting quasi-probabilities are mapped to the nearest probability distributions.
+        """
+        counts = as_counts(counts)
+        probs = counts.dense(reverse=True).astype(float)
+        probs = probs / probs.sum(axis=1, keepdims=True)
+        quasi_probs = self.matmul(probs.T, inverse=True).T
+        return Counts.from_dense(nearest_probabilities(quasi_probs), reverse=True, tol=0)
+
+def nearest_probabilities(quasi_probs: np.ndarray) -> np.ndarray:
+    """
+    Maps every row of quasi-probabilities to the nearest (in the 2-norm) probability distribution,
+    as Qiskit's QuasiDistribution.nearest_probability_distribution() does for a single one.
+    """
+    ordered = -np.sort(-quasi_probs, axis=1)
+    cumulative = np.cumsum(ordered, axis=1) - 1
+    ranks = np.arange(1, quasi_probs.shape[1] + 1)
+    support = np.sum(ordered - cumulative / ranks > 0, axis=1)
+    theta = cumulative[np.arange(len(quasi_probs)), support - 1] / support
+    return np.maximum(quasi_probs - theta[:, None], 0)
+
+def poly_extrapolate(
+        scale_factors: np.ndarray, 
+        exp_values: np.ndarray, 
+        order: int
+    ) -> np.ndarray:
+    """
+    Extrapolates every column of expectation values (of shape [scale factors, K]) to zero noise with
+    a polynomial fit of the given order, as mitiq's PolyFactory.extrapolate does for a single one, 
+    but with one least squares solve for all columns.
+    """
+    vandermonde = np.vander(np.asarray(scale_factors, dtype=float), order + 1)
+    # Normalizing the columns (as np.polyfit does) keeps the solve well conditioned
+    norms = np.sqrt(np.sum(vandermonde ** 2, axis=0))
+    coefficients = np.linalg.lstsq(vandermonde / norms, exp_values, rcond=None)[0] / norms[:, None]
+    return coefficients[-1]
 
 def get_measured_qubits(circuit):
     """
@@ -60,30 +460,46 @@ class ErrorMitigator:
     """
     class ReadoutError:
         """
-        Retrieves and/or enters results from the REM table based on the boolean "use_table".
+        Retrieves and/or enters the fitted readout mitigator from the REM table based on the 
+        boolean "use_table"; the experiment is only run if the table has no fresh entry for the current 
+        backend "calibration" (see ResponseMatrixTable.calibration).
+        With "local", runs a LocalReadoutError experiment (2 circuits) instead of a 
+        CorrelatedReadoutError one (2^N circuits).
         """
-        result: ExperimentData
+        mitigator: CorrelatedReadoutMitigator | LocalReadoutMitigator
         
         def __init__(
             self,
             lattice: Lattice,
             backend: IBMBackend,
-            service: QiskitRuntimeService,
+            table: REMTable,
             use_table: bool,
+            calibration: str,
+            local: bool = False
             ) -> None:
+            from qiskit_experiments.data_processing import CorrelatedReadoutMitigator, LocalReadoutMitigator
 
             dims = lattice.dims
-            measured_qubits = StepCircuit(lattice, 1).grid_qubits
-            exp = CorrelatedReadoutError(measured_qubits)
-            
-            table = REMTable(service)
-            if use_table and path.exists(f"rem-table/{backend.name}_{dims[0]}x{dims[1]}.json"):
-                    result = table.load(dims, backend, exp)
+            measured_qubits = StepCircuitBuilder.for_lattice(lattice).grid_qubits
+
+            matrices = table.load(dims, backend.name, measured_qubits, calibration, local) if use_table else None
+            if matrices is None:
+                from qiskit_experiments.library import CorrelatedReadoutError, LocalReadoutError
+
+                exp = LocalReadoutError(measured_qubits) if local else CorrelatedReadoutError(measured_qubits)
+                result = exp.run(backend).block_for_results()
+                name = "Local Readout Mitigator" if local else "Correlated Readout Mitigator"
+                mitigator = result.analysis_results(name, dataframe=True).iloc[0].value
+                if local:
+                    matrices = np.array([mitigator.assignment_matrix([q]) for q in measured_qubits])
+                else:
+                    matrices = mitigator.assignment_matrix()
+                table.enter(dims, backend.name, measured_qubits, matrices, result.job_ids[0], calibration, local)
+
+            if local:
+                self.mitigator = LocalReadoutMitigator(list(matrices), measured_qubits)
             else:
-                result = exp.run(backend)
-                table.enter(dims, result.job_ids[0])
-            
-            self.result = result
+                self.mitigator = CorrelatedReadoutMitigator(matrices, measured_qubits)
 
     dims: list | tuple
     lattice: CollisionlessLattice | Lattice
@@ -93,6 +509,14 @@ class ErrorMitigator:
     readout_error_mitigation: bool
     iterative_bayesian_unfolding: bool
     zero_noise_extrapolation: bool
+    warm_start: bool
+    rem_mode: str
+    block_size: int
+    readout_model: BlockReadoutModel | None
+    rem_table: REMTable
+    response_table: ResponseMatrixTable
+    transpile_cache: TranspilationCache
+    ibu_updates: list[int]
 
     def __init__(
             self,
@@ -102,8 +526,19 @@ class ErrorMitigator:
             equalization: bool = False,
             readout_error_mitigation: bool = False,
             iterative_bayesian_unfolding: bool = False,
-            zero_noise_extrapolation: bool = False
+            zero_noise_extrapolation: bool = False,
+            warm_start: bool = False,
+            rem_mode: str = "correlated",
+            block_size: int = 2,
+            transpile_cache: TranspilationCache | None = None
         ) -> None:
+        """
+        rem_mode: str, "correlated" (CorrelatedReadoutError, with a full 2^N x 2^N assignment matrix),
+            "block" (BlockReadoutModel of correlated blocks of "block_size" neighbouring qubits),
+            "tensored" (independent qubits calibrated with LocalReadoutError) or "properties" 
+            (independent qubits, with the response matrices of the backend properties)
+        transpile_cache: TranspilationCache, (optional) shared with the runner so ZNE reuses its cache
+        """
         self.lattice = lattice
         self.dims = lattice.dims
         self.backend = backend
@@ -112,24 +547,40 @@ class ErrorMitigator:
         self.readout_error_mitigation = readout_error_mitigation
         self.iterative_bayesian_unfolding = iterative_bayesian_unfolding
         self.zero_noise_extrapolation = zero_noise_extrapolation
+        self.warm_start = warm_start
+        self.rem_mode = rem_mode
+        self.block_size = block_size
+        self.readout_model = None
+        self.rem_table = REMTable(service)
+        self.response_table = ResponseMatrixTable()
+        self.transpile_cache = transpile_cache if transpile_cache is not None else TranspilationCache()
+        self.ibu_updates = []
     
     def rem(
             self,
             shots: int,
-            counts: list,
-            use_table: bool = True
-        ) -> list:
+            counts: list | Counts,
+            use_table: bool = True,
+            job_id: str | None = None
+        ) -> Counts:
             
         print("Mitigating readout error...")
 
-        result = ErrorMitigator.ReadoutError(self.lattice, self.backend, self.service, use_table).result
+        counts = as_counts(counts)
+        if self.rem_mode == "block":
+            return self.block_readout_model(shots).mitigate(counts).scaled(shots)
+        if self.rem_mode in ("tensored", "properties"):
+            return self.tensored_readout_model(use_table, job_id).mitigate(counts).scaled(shots)
 
-        mitigator = result.analysis_results("Correlated Readout Mitigator", dataframe=True).iloc[0].value
+        mitigator = ErrorMitigator.ReadoutError(
+            self.lattice, self.backend, self.rem_table, use_table, self.response_table.calibration(self.backend)
+        ).mitigator
         mitigated_quasi_probs = [mitigator.quasi_probabilities(count) for count in counts]
 
-        mitigated_probs = [(prob.nearest_probability_distribution().binary_probabilities()) for prob in mitigated_quasi_probs]
+        # Probability distributions are keyed by integer outcomes, so no bitstrings are needed
+        mitigated_probs = [prob.nearest_probability_distribution() for prob in mitigated_quasi_probs]
 
-        mitigated_counts = [{label: int(prob * shots) for label, prob in mitigated_prob.items()} for mitigated_prob in mitigated_probs]
+        mitigated_counts = Counts.from_int_dicts(mitigated_probs, counts.num_bits).scaled(shots)
         
         return mitigated_counts
         
@@ -137,120 +588,289 @@ class ErrorMitigator:
             self,
             qcs: list[QuantumCircuit],
             shots: int,
-            counts: list,
-        ) -> list:
+            counts: list | Counts,
+            batched: bool = True,
+            job_id: str | None = None,
+            warm_start: bool | None = None,
+            permutation: np.ndarray | None = None,
+            floor: float = 1e-3,
+            readout_model: BlockReadoutModel | None = None,
+            compiled: bool = False,
+            accel: str | None = None
+        ) -> Counts:
         """
         (NOT MY CODE)
         Modified based on PyIBU tutorial.ipynb
         Credit: https://github.com/sidsrinivasan/PyIBU
+        batched: bool, unfold all timesteps at once in a single vectorized IBU run (jax only)
+        job_id: str, the job the counts come from; lets the response matrix table skip backend property calls
+        warm_start: bool, start each timestep's IBU from the previous timestep's solution instead of the 
+            uniform distribution (runs the timesteps one after another); defaults to self.warm_start
+        permutation: np.ndarray, (optional) where each outcome moves to from one timestep to the next 
+            (e.g. the streaming step), as integer outcomes: permutation[int(bitstring, 2)]
+        floor: float, total probability mass of a warm start that is spread uniformly over all outcomes
+            ((1 - floor) * previous + floor / 2^N), so outcomes that were (nearly) unobserved in the 
+            previous timestep can still be recovered
+        readout_model: BlockReadoutModel, (optional) unfold with correlated readout blocks instead of the 
+            single-qubit response matrices (only for the "full" method with jax/numpy)
+        compiled: bool, run the whole IBU loop as one compiled jax while loop (jax only)
+        accel: str, (optional) "squarem" to accelerate IBU with SQUAREM extrapolation
+        The number of plain IBU updates of every timestep (three per SQUAREM cycle with accel) is
+        recorded in self.ibu_updates.
         """
         print("Performing Iterative Bayesian Unfolding...")
+        from ibu_src.IBU import IBU
 
+        counts = as_counts(counts)
+        if warm_start is None:
+            warm_start = self.warm_start
         measured_qubits_list = [get_measured_qubits(qc) for qc in qcs]
 
         params = {
             "exp_name": "qlbm",
             "method": "full",  # options: "full", "reduced"
-            "library": "jax",  # options: "tensorflow" (for "full" only) or "jax"
+            "library": "jax",  # options: "tensorflow" or "numpy" (for "full" only) or "jax"
             "num_qubits": len(measured_qubits_list[0]),
             "max_iters": 100,
             "tol": 1e-4,
             "use_log": False,  # options: True or False
+            "compiled": compiled,  # options: True or False (for "jax" only)
+            "accel": accel,  # options: None or "squarem" (not with "use_log" or "tensorflow")
             "verbose": False,
             "init": "unif",  # options: "unif" or "unif_obs" or "obs"
             "smoothing": 1e-8
         }
         if params["library"] == 'tensorflow':
+            import tensorflow as tf
             params.update({
                 "max_iters": tf.constant(params["max_iters"]),
                 "eager_run": True
             })
             tf.config.run_functions_eagerly(params["eager_run"])
 
-        matrices_list = [[get_response_matrix(self.backend, q) for q in measured_qubits] for measured_qubits in measured_qubits_list]
+        # Identical qubit layouts (across timesteps, or ZNE scale factors) share their matrices
+        if readout_model is not None:
+            params["blocks"] = readout_model.blocks
+            layout_matrices = {
+                tuple(layout): readout_model.matrices
+                for layout in set(tuple(measured_qubits) for measured_qubits in measured_qubits_list)
+            }
+        else:
+            layout_matrices = {
+                tuple(layout): self.response_table.matrices(self.backend, list(layout), job_id=job_id)
+                for layout in set(tuple(measured_qubits) for measured_qubits in measured_qubits_list)
+            }
+        matrices_list = [layout_matrices[tuple(measured_qubits)] for measured_qubits in measured_qubits_list]
+
+        if batched and not warm_start and params["method"] == "full" and params["library"] == "jax":
+            ibu = IBU(matrices_list[0], params)
+            # PyIBU indexes bitstrings in reverse order
+            obs = counts.dense(reverse=True).astype(float)
+            obs = (obs / obs.sum(axis=1, keepdims=True))[..., None]
+            ibu.set_obs_batch(np.log(obs) if params["use_log"] else obs)
+            # Only pass per-step matrices when the steps were measured on different qubits
+            same_layout = len(layout_matrices) == 1 or readout_model is not None
+            t_sols, _ = ibu.train_batch(
+                params["max_iters"], 
+                tol=params["tol"], 
+                mats_batch=None if same_layout else matrices_list
+            )
+            self.ibu_updates = ibu.updates
+            return Counts.from_dense(t_sols, reverse=True, tol=1e-6).scaled(shots)
 
         ibu_mitigated = []
+        self.ibu_updates = []
+        # Timesteps measured on the same qubits share an IBU object (and so its compiled jax code)
+        ibus = {}
         for i in range(len(matrices_list)):
-            ibu = IBU(matrices_list[i], params)
-            ibu.set_obs(dict(counts[i]))
-            ibu.initialize_guess()
+            layout = tuple(measured_qubits_list[i])
+            if layout not in ibus:
+                ibus[layout] = IBU(matrices_list[i], params)
+            ibu = ibus[layout]
+            ibu.set_obs(counts.to_dict(i))
+            if warm_start and i > 0:
+                self.warm_start_guess(ibu, ibu_mitigated[-1], counts.num_bits, params, permutation, floor)
+            else:
+                ibu.initialize_guess()
             # 4x4 first timestep theoretically perfect lattice data, not used
             # t_true_dict = {"0001" : 1/8, "0010" : 1/8, "0101" : 1/8, "0110" : 1/8, "1001" : 1/8, "1010" : 1/8, "1101" : 1/8, "1110" : 1/8}
-            t_sol, max_iters, tracker = ibu.train(params["max_iters"], tol=params["tol"])
+            t_sol, iterations, tracker = ibu.train(params["max_iters"], tol=params["tol"])
+            self.ibu_updates.append(ibu.updates)
             
-            ibu_mitigated.append({label: int(prob[0] * shots) for label, prob in ibu.guess_as_dict().items()})
+            ibu_mitigated.append({label: prob[0] for label, prob in ibu.guess_as_dict().items()})
 
-        return ibu_mitigated
+        if params["verbose"]:
+            print(f"IBU updates per timestep: {self.ibu_updates} (total: {sum(self.ibu_updates)} updates)")
+
+        return Counts.from_dicts(ibu_mitigated, counts.num_bits).scaled(shots)
+
+    def warm_start_guess(
+            self,
+            ibu: IBUFull | IBUReduced,
+            previous: dict,
+            num_bits: int,
+            params: dict,
+            permutation: np.ndarray | None = None,
+            floor: float = 1e-3
+        ):
+        """
+        Initializes the guess of an IBU object with the solution of the previous timestep (a dict of 
+        bitstrings mapped to probabilities), moved by the permutation if given and floored: a total
+        mass of "floor" is spread uniformly over the outcomes, (1 - floor) * previous + floor / K for 
+        K outcomes (2^N, or the tracked bitstrings of the "reduced" method).
+        """
+        from ibu_utils.data_utils import normalize_vec
+
+        previous = Counts.from_dicts([previous], num_bits)
+        if permutation is not None:
+            previous.indices[0] = np.asarray(permutation)[previous.indices[0]]
+
+        if params["method"] == "full":
+            # PyIBU indexes bitstrings in reverse order
+            init = previous.to_dense(0, reverse=True).reshape(-1, 1)
+            init = (1 - floor) * init / init.sum() + floor / init.shape[0]
+            ibu.initialize_guess(init=normalize_vec(init, params["library"], params["use_log"]))
+        else:
+            ibu.initialize_guess(init=previous.to_dict(0))
+            init = ibu.init
+            ibu.initialize_guess(init=(1 - floor) * init + floor / init.shape[0])
     
+    def block_readout_model(self, shots: int = DEFAULT_SHOTS) -> BlockReadoutModel:
+        """
+        Calibrates (once) the BlockReadoutModel of the grid qubits on the backend, with blocks of 
+        "self.block_size" neighbouring qubits.
+        """
+        if self.readout_model is None:
+            measured_qubits = StepCircuitBuilder.for_lattice(self.lattice).grid_qubits
+            blocks = BlockReadoutModel.neighbour_blocks(len(measured_qubits), self.block_size)
+            circuits = BlockReadoutModel(blocks, []).calibration_circuits(measured_qubits)
+
+            print(f"Calibrating readout blocks with {len(circuits)} circuits... ", end="")
+            pass_manager = generate_preset_pass_manager(
+                optimization_level=0,
+                backend=self.backend,
+                initial_layout=list(range(circuits[0].num_qubits))
+            )
+            job = Sampler(self.backend).run(pass_manager.run(circuits), shots=shots)
+            counts = Counts.from_bit_arrays([result.join_data() for result in job.result()])
+            self.readout_model = BlockReadoutModel.from_calibration(blocks, counts)
+            print("done.")
+
+        return self.readout_model
+
+    def tensored_readout_model(
+            self, 
+            use_table: bool = True, 
+            job_id: str | None = None
+        ) -> BlockReadoutModel:
+        """
+        Builds the tensored BlockReadoutModel of the grid qubits, from a LocalReadoutError experiment 
+        (rem_mode "tensored") or from the response matrix table (rem_mode "properties").
+        """
+        measured_qubits = StepCircuitBuilder.for_lattice(self.lattice).grid_qubits
+        if self.rem_mode == "properties":
+            return BlockReadoutModel.tensored(
+                self.response_table.matrices(self.backend, measured_qubits, job_id=job_id)
+            )
+
+        mitigator = ErrorMitigator.ReadoutError(
+            self.lattice, self.backend, self.rem_table, use_table, self.response_table.calibration(self.backend),
+            local=True
+        ).mitigator
+        return BlockReadoutModel.tensored([mitigator.assignment_matrix([q]) for q in measured_qubits])
+
     def zne(
             self,
             shots: int,
-            steps: int = 1
-        ) -> tuple[list[dict], str]:
+            steps: int = 1,
+            sampler: Sampler | SimSampler | None = None,
+            seed: int | None = 0
+        ) -> tuple[Counts, str]:
         """
         Runs Zero Noise Extrapolation. Omits the 0th step of the visualization since it is of depth 1 and thus gets good results.
-
+        All circuits (every scale factor of every step, and the 0th step) are submitted as a single job.
+        sampler: (optional) the SamplerV2 to run the circuits with, e.g. an Aer sampler for local testing; 
+            defaults to a runtime Sampler on self.backend
+        seed: int, seeds the random gate folding, so repeat runs fold (and so transpile) the same circuits 
+            and can take them from the transpilation cache; None folds differently every time
         """
         print("Performing Zero Noise Extrapolation...")
+        from mitiq import zne
 
-        step_qcs = [StepCircuit(self.lattice, step) for step in range(steps+1)]
-        circuits = [step_qc.circuit for step_qc in step_qcs]
+        circuits = StepCircuitBuilder.for_lattice(self.lattice).circuits(steps)
 
         # This is how the 0th step is omitted; it will be run normally and prepended at the end.
         first = circuits.pop(0)
 
-        measured_qubits = step_qcs[0].grid_qubits
-
         scale_factors = np.array([1., 1.5, 2., 2.5, 3., 3.5, 4.])
-        folded_circuits = [[
-                zne.scaling.fold_gates_at_random(circuit, scale)
-                for scale in scale_factors
-        ] for circuit in circuits ]
-
-        pm = generate_preset_pass_manager(
-            backend=self.backend,
+        settings = dict(
             basis_gates=None,
             optimization_level=0, # Important to preserve folded gates.
         )
-        
-        first_exec = pm.run([first])
 
-        exec_circuits = [pm.run(folded_circuit) for folded_circuit in folded_circuits]
+        first_exec = self.transpile_cache.run([first], self.backend, **settings)
+
+        if seed is None:
+            pm = generate_preset_pass_manager(backend=self.backend, **settings)
+            exec_circuits = [[
+                    pm.run(zne.scaling.fold_gates_at_random(circuit, scale))
+                    for scale in scale_factors
+            ] for circuit in circuits ]
+        else:
+            # Folding is only deterministic given the seed, so folded circuits are cached by it
+            exec_by_scale = [
+                self.transpile_cache.run(
+                    circuits, 
+                    self.backend, 
+                    transform=lambda qc, scale=scale: zne.scaling.fold_gates_at_random(qc, scale, seed=seed),
+                    transform_key=f"fold_gates_at_random({scale}, seed={seed})",
+                    **settings
+                )
+                for scale in scale_factors
+            ]
+            exec_circuits = [list(step_exec) for step_exec in zip(*exec_by_scale)]
         
-        sampler = Sampler(self.backend)
-
-        first_job = sampler.run(first_exec)
-
-        jobs = [sampler.run(exec_circuit, shots=shots) for exec_circuit in exec_circuits]
+        if sampler is None:
+            sampler = Sampler(self.backend)
+
+        # One submission (and so one queue wait) for everything: the 0th step, then the scale 
+        # factors of every step in order
+        job = sampler.run(first_exec + [qc for exec_circuit in exec_circuits for qc in exec_circuit], shots=shots)
+        results = job.result()
+        first_result = results[0]
+        step_results = [
+            [results[1 + step * len(scale_factors) + i] for i in range(len(scale_factors))]
+            for step in range(steps)
+        ]
 
         # Raw
-        all_counts = [[job.result()[i].join_data().get_counts() for i in range(len(scale_factors))] for job in jobs]
+        all_counts = [Counts.from_bit_arrays([result.join_data() for result in step_result]) for step_result in step_results]
         # REM implementation
         all_counts = [self.rem(shots, all_count) for all_count in all_counts]
-        # IBU Implementation
-        all_counts = [self.ibu(circ, shots, count) for circ, count in zip(exec_circuits, all_counts)]
-
-        bitstrings = generate_bitstrings(len(measured_qubits))
-
-        # Array of arrays of expectation values of bitstrings
-        # [[circuit 1 exp vals], [circuit 2 exp vals]]
-        all_exps_arr = []
-
-        for step in range(0, steps):
-            all_exps = {}
-            for bitstring in bitstrings:
-                try:
-                    all_exps[bitstring] = [counts.get(bitstring) / shots for counts in all_counts[step]]
-                except TypeError:
-                    all_exps[bitstring] = [0 for counts in all_counts[step]]
-            all_exps_arr += [all_exps]
-
-        zero_noise_values_arr = [[zne.PolyFactory.extrapolate(scale_factors, exp, 2) for exp in all_exps.values()] for all_exps in all_exps_arr]
-        m_vals = [[int(znv * shots) for znv in zero_noise_values] for zero_noise_values in zero_noise_values_arr]
-        
-        mitigated_counts = [dict(zip(bitstrings, m_val)) for m_val in m_vals]
+        # IBU Implementation (with the correlated readout blocks too, if those are the REM model)
+        readout_model = self.block_readout_model(shots) if self.rem_mode == "block" else None
+        all_counts = [
+            self.ibu(circ, shots, count, readout_model=readout_model) 
+            for circ, count in zip(exec_circuits, all_counts)
+        ]
+
+        # Expectation values of every outcome (in bitstring order), of shape [steps, scale factors, outcomes]
+        all_exps = np.array([step_counts.dense() for step_counts in all_counts]) / shots
+
+        # Outcomes that were not observed at every scale factor are not extrapolated (they stay 0)
+        observed = np.zeros(all_exps.shape, dtype=bool)
+        for step, step_counts in enumerate(all_counts):
+            for i, idx in enumerate(step_counts.indices):
+                observed[step, i, idx] = True
+        observed = observed.all(axis=1)
+
+        zero_noise_values_arr = np.zeros((steps, all_exps.shape[2]))
+        zero_noise_values_arr[observed] = poly_extrapolate(scale_factors, all_exps.transpose(1, 0, 2)[:, observed], 2)
         
-        mitigated_counts.insert(0, first_job.result()[0].join_data().get_counts())
+        mitigated_counts = Counts.concatenate([
+            Counts.from_bit_arrays([first_result.join_data()]),
+            Counts.from_dense(zero_noise_values_arr).scaled(shots)
+        ])
 
         if self.equalization:
             mitigated_counts = self.equalize(mitigated_counts, shots)
@@ -261,9 +881,9 @@ class ErrorMitigator:
         
     def equalize(
             self,
-            counts: list[dict],
+            counts: list[dict] | Counts,
             shots: int
-        ) -> list[dict]:
+        ) -> Counts:
         """
         "Equalizes" the visualization by cropping the lowest-counted half of the data and setting 
         the highest-counted half to the theoretically correct number of counts, which is:
@@ -271,38 +891,35 @@ class ErrorMitigator:
         Currently only implemented for ZNE.
         """
 
-        measured_qubits = StepCircuit(self.lattice, 0).grid_qubits
-        equalized_counts = []
+        counts = as_counts(counts)
+        # Every grid qubit is measured, so the counts are over exactly the grid qubits
+        equalized_values = []
 
-        for count in counts:
-            cutoff = sorted(list(count.values()))[2 ** (len(measured_qubits) - 1)]
-            eq_count = {}
-            for key, val in count.items():
-                if val < cutoff:
-                    eq_count.update({key : 0})
-                else:
-                    eq_count.update({key: shots/(self.lattice.dims[0] * self.lattice.dims[1] * 0.5)})
-            equalized_counts += [eq_count]
+        for values in counts.values:
+            cutoff = np.sort(values)[2 ** (counts.num_bits - 1)]
+            equalized_values += [np.where(values < cutoff, 0, shots/(self.lattice.dims[0] * self.lattice.dims[1] * 0.5))]
         
-        return equalized_counts
+        return Counts(counts.indices, equalized_values, counts.num_bits)
 
     def mitigate(
         self,
         qcs: list[QuantumCircuit],
         shots: int,
-        counts: list,
-        ) -> tuple[list[dict], str]:
+        counts: list | Counts,
+        job_id: str | None = None
+        ) -> tuple[Counts, str]:
         
         # Data shows that performing REM and then IBU yields better results.
         if (self.readout_error_mitigation == False and self.iterative_bayesian_unfolding == False):
             label = f"raw-collisionless-{self.dims[0]}x{self.dims[1]}-ibm-qpu"
-            return counts, label
+            return as_counts(counts), label
         if (self.readout_error_mitigation == True):
             label = f"rem-collisionless-{self.dims[0]}x{self.dims[1]}-ibm-qpu"
-            counts = self.rem(shots, counts)
+            counts = self.rem(shots, counts, job_id=job_id)
         if (self.iterative_bayesian_unfolding == True):
             label = f"ibu-collisionless-{self.dims[0]}x{self.dims[1]}-ibm-qpu"
-            counts = self.ibu(qcs, shots, counts)
+            readout_model = self.block_readout_model(shots) if self.rem_mode == "block" else None
+            counts = self.ibu(qcs, shots, counts, job_id=job_id, readout_model=readout_model)
         if (self.readout_error_mitigation == True and self.iterative_bayesian_unfolding == True):
             label = f"rem-ibu-collisionless-{self.dims[0]}x{self.dims[1]}-ibm-qpu"
         return counts, label
@@ -1,5 +1,8 @@
 from base import *
 from error_mitigator import ErrorMitigator
+from qiskit_ibm_runtime import QiskitRuntimeService, IBMBackend
+from qiskit_ibm_runtime import SamplerV2 as Sampler
+from qiskit_ibm_runtime import SamplerOptions
 
 class IBM_QPU_Runner(Runner):
     """
@@ -11,6 +14,8 @@ class IBM_QPU_Runner(Runner):
         dims: tuple
         service: QiskitRuntimeService
         label: str, name of the file without extension
+        transpile_cache: TranspilationCache, shared with the error mitigator; transpiles in parallel with
+            "num_processes" processes (None: Qiskit's default, i.e. every CPU)
     """
 
     lattice: CollisionlessLattice | Lattice
@@ -19,6 +24,7 @@ class IBM_QPU_Runner(Runner):
     service: QiskitRuntimeService
     backend: IBMBackend
     transpiled_circuits: list[QuantumCircuit]
+    transpile_cache: TranspilationCache
     label: str
     error_mitigator: ErrorMitigator
 
@@ -30,15 +36,20 @@ class IBM_QPU_Runner(Runner):
             readout_error_mitigation: bool = False,
             iterative_bayesian_unfolding: bool = False,
             zero_noise_extrapolation: bool = False,
-            equalization: bool = False
+            equalization: bool = False,
+            warm_start: bool = False,
+            rem_mode: str = "correlated",
+            num_processes: int | None = None
         ) -> None:
         
+        super().__init__()
         print(f"Initializing {dims[0]}x{dims[1]} runner... ", end="")
         self.service = QiskitRuntimeService(name=name)
         self.backend = QiskitRuntimeService().least_busy(simulator=False, operational=True, min_num_qubits=25)
 
         self.dims = dims
         self.lattice = Lattice(dims, vs=vs)
+        self.transpile_cache = TranspilationCache(num_processes=num_processes)
 
         self.error_mitigator = ErrorMitigator(
             self.lattice, 
@@ -47,7 +58,10 @@ class IBM_QPU_Runner(Runner):
             readout_error_mitigation=readout_error_mitigation,
             iterative_bayesian_unfolding=iterative_bayesian_unfolding,
             zero_noise_extrapolation=zero_noise_extrapolation,
-            equalization=equalization
+            equalization=equalization,
+            warm_start=warm_start,
+            rem_mode=rem_mode,
+            transpile_cache=self.transpile_cache
         )
         
         print("done.")
@@ -64,16 +78,21 @@ class IBM_QPU_Runner(Runner):
         """
 
         if self.error_mitigator.zero_noise_extrapolation:
-            counts, self.label = self.error_mitigator.zne(shots, steps=steps)
+            with self.stage("mitigate"):
+                counts, self.label = self.error_mitigator.zne(shots, steps=steps)
             return counts
         else:
 
             print("Creating and transpiling circuits... ", end="")
 
-            step_qcs = [StepCircuit(self.lattice, i, collision=False, init_cond=init_cond).circuit for i in range(steps+1)]
+            with self.stage("build"):
+                step_qcs = StepCircuitBuilder.for_lattice(self.lattice, init_cond=init_cond, collision=False).circuits(steps)
 
-            pass_manager = generate_preset_pass_manager(optimization_level=1, backend=self.backend)
-            self.transpiled_circuits = [pass_manager.run(qc) for qc in step_qcs]
+            with self.stage("transpile"):
+                keys = self.transpile_cache.keys(step_qcs, self.backend, optimization_level=1)
+                self.transpiled_circuits = self.transpile_cache.run(
+                    step_qcs, self.backend, keys=keys, optimization_level=1
+                )
 
             options = SamplerOptions()
             options.dynamical_decoupling.enable = True
@@ -87,6 +106,8 @@ class IBM_QPU_Runner(Runner):
 
             job = sampler.run(self.transpiled_circuits, shots=shots)
             self.job_id = job.job_id()
+            # Re-visualizations of the job load exactly these circuits, whatever the backend's calibration
+            self.transpile_cache.record_job(self.job_id, keys)
 
             print("done.")
 
@@ -100,7 +121,7 @@ class IBM_QPU_Runner(Runner):
             steps: int, 
             shots: int = DEFAULT_SHOTS,
             job_id: str | None = None,
-            counts: list[dict] | None = None
+            counts: Counts | list[dict] | None = None
         ) -> str:
         """
         Takes the counts of the measurement data from the IBM QPU and turns it into a PyVista simulation.
@@ -115,15 +136,24 @@ class IBM_QPU_Runner(Runner):
             if (job_id != None):
                 self.job_id = job_id
                 self.backend = self.service.job(job_id).backend()
-                step_qcs = [StepCircuit(self.lattice, i, collision=False).circuit for i in range(steps+1)]
-                pass_manager = generate_preset_pass_manager(optimization_level=1, backend=self.backend)
-                self.transpiled_circuits = [pass_manager.run(qc) for qc in step_qcs]
+                self.transpiled_circuits = self.transpile_cache.load_job(job_id)
+                if self.transpiled_circuits is None:
+                    # Jobs that were not run through the cache are transpiled again, against the current 
+                    # calibration of the backend (which may choose another layout than the job's)
+                    print(f"Job {job_id} is not in the transpilation cache; transpiling its circuits again.")
+                    with self.stage("build"):
+                        step_qcs = StepCircuitBuilder.for_lattice(self.lattice, collision=False).circuits(steps)
+                    with self.stage("transpile"):
+                        self.transpiled_circuits = self.transpile_cache.run(
+                            step_qcs, self.backend, optimization_level=1
+                        )
 
             job = self.service.job(self.job_id)
             results = job.result()
-            raw_counts = [list(results[i].data.values())[0].get_counts() for i in range(steps+1)]
+            raw_counts = Counts.from_bit_arrays([list(results[i].data.values())[0] for i in range(steps+1)])
 
-            counts, self.label = self.error_mitigator.mitigate(self.transpiled_circuits, shots, raw_counts)
+            with self.stage("mitigate"):
+                counts, self.label = self.error_mitigator.mitigate(self.transpiled_circuits, shots, raw_counts, job_id=self.job_id)
 
         vis = super().visualize(counts, steps, shots=shots) # :)
 
@@ -147,16 +177,10 @@ class IBM_QPU_Runner(Runner):
         
         job = self.run(steps, shots=shots, init_cond=init_cond)
         
-        start = int(time.time())
         print("Waiting for IBM QPU data...")
-        time.sleep(1)
-        print()
-        while (job.status() != "DONE"):
-            time.sleep(0.9)
-            diff = int(time.time()) - start
-            print("\r", end="")
-            print(f"Time elapsed: {int(diff/60)} minute(s) and {diff % 60} second(s).", end="")
-        print(f"\nData received. Workload: {int(job.usage())} seconds.")
+        with self.stage("execute"):
+            job.result() # blocks until the job is done
+        print(f"Data received. Workload: {int(job.usage())} seconds.")
         time.sleep(2) # make them wait for it.
         vis = self.visualize(
             steps, shots=shots
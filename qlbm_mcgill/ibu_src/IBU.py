@@ -1,14 +1,18 @@
+from __future__ import annotations
 from ibu_src.IBUFull import IBUFull
-from ibu_src.IBUReduced import IBUReduced
 import numpy as np
-from typing import List, Union
+from typing import List, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ibu_src.IBUReduced import IBUReduced
 
 
 def IBU(mats_true: List[np.ndarray], params: dict,
         mem_constrained: bool = False) -> Union[IBUFull, IBUReduced]:
     """
     :param mats_true: a list of 2x2 conditional probability tables representing
-                      error probabilities for each qubit
+                      error probabilities for each qubit (or for each block of
+                      qubits, see "blocks")
     :param params: a dict specifying the following:
                 - exp_name: str, name of experiment
                 - num_qubits: int, number of qubits
@@ -16,6 +20,17 @@ def IBU(mats_true: List[np.ndarray], params: dict,
                 - library: str, "jax" or "tensorflow" or "numpy"
                 - use_log: bool, whether to use log-space (numerical precision)
                 - verbose: bool, verbosity of status updates
+                - compiled: (optional) bool, whether to run the whole training
+                            loop on-device in a single jax while loop
+                - accel: (optional) None or "squarem", whether to accelerate
+                         the IBU iterations with SQUAREM extrapolation (not
+                         supported in log space or with tensorflow); in
+                         verbose mode, the iterations saved are reported
+                - blocks: (optional) list of lists of qubits, for a readout
+                          model of correlated blocks of qubits (for "full" with
+                          jax/numpy only); mats_true then holds one
+                          2^b x 2^b matrix per block instead of one 2x2 matrix
+                          per qubit
     :param mem_constrained: bool: True/False, for IBU Reduced ONLY; uses a
                             memory efficient implementation
     :return: object of IBUFull, or IBUReduced, depending on method specified in
@@ -24,6 +39,8 @@ def IBU(mats_true: List[np.ndarray], params: dict,
     if params['method'] == 'full':
         return IBUFull(mats_true, params)
     elif params['method'] == 'reduced':
+        # IBUReduced is jax-only, so jax is imported along with it
+        from ibu_src.IBUReduced import IBUReduced
         return IBUReduced(mats_true, params, mem_constrained)
     else:
         raise "Unsupported method!"
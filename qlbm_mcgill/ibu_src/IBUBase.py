@@ -1,8 +1,11 @@
+from __future__ import annotations
 from abc import ABC, abstractmethod
 from typing import Union
 import numpy as np
-import jax.numpy as jnp
-import tensorflow as tf
+from ibu_utils.lazy_utils import LazyModule
+
+jnp = LazyModule("jax.numpy")
+tf = LazyModule("tensorflow")
 
 
 class IBUBase(ABC):
@@ -1,10 +1,14 @@
+from __future__ import annotations
 from ibu_utils.data_utils import *
+from ibu_utils.lazy_utils import LazyModule, lazy_jit
 from ibu_src.IBUBase import IBUBase
+from ibu_src.squarem import squarem_step, obs_loglik, UPDATES_PER_CYCLE
 from typing import Union, List, Tuple
 from functools import partial
-from jax import jit
 from tqdm import tqdm
 
+jax = LazyModule("jax")
+
 
 class IBUFull(IBUBase):
 
@@ -13,14 +17,43 @@ class IBUFull(IBUBase):
         self._num_qubits = params['num_qubits']
         self._library = params['library']
         self._use_log = params['use_log']
+        self._compiled = params.get('compiled', False)
+        self._accel = params.get('accel', None)
 
         self._verbose = params['verbose']
 
+        if self._accel is not None:
+            if self._accel != 'squarem':
+                raise NotImplementedError(f"Unknown acceleration "
+                                          f"{self._accel}!")
+            if self._library == 'tensorflow' or self._use_log:
+                raise NotImplementedError("SQUAREM acceleration is only "
+                                          "supported with jax/numpy and "
+                                          "without log space!")
+        self.updates = None
+        self.iterations_saved = None
+
+        # Correlated readout blocks; mats_raw then holds one op per block
+        self._blocks = params.get('blocks', None)
+        if self._blocks is not None:
+            if self._library == 'tensorflow':
+                raise NotImplementedError("Block readout models are only "
+                                          "supported with jax/numpy!")
+            self._blocks = tuple(tuple(block) for block in self._blocks)
+
+        if self._library == 'tensorflow':
+            # Compiled here rather than decorated, so tensorflow is only
+            # imported when it is the chosen library
+            self._kron_matmul_tf = tf.function(self._kron_matmul_tf)
+            self._train_iter_tf = tf.function(self._train_iter_tf)
+
         self._mats = self.mats_to_kronstruct(mats_raw, transpose=False)
         self._matsT = self.mats_to_kronstruct(mats_raw, transpose=True)
         self._obs = None
         self._init = None
         self._guess = None
+        self._obs_batch = None
+        self._guess_batch = None
 
     @property
     def num_qubits(self):
@@ -79,6 +112,16 @@ class IBUFull(IBUBase):
             return self._guess
         return vec_to_dict(self.guess, tol)
 
+    def guess_batch_as_dicts(self, tol: float = 1e-6) -> List[dict]:
+        """
+            Returns the solutions of the last train_batch() call as one
+            dictionary of bitstrings mapped to probabilities per batch entry.
+        """
+        if self._guess_batch is None:
+            return self._guess_batch
+        return [vec_to_dict(guess, tol)
+                for guess in np.asarray(self._guess_batch)]
+
     ############################################################################
     #                     DATA PROCESSING / GENERATION
     ############################################################################
@@ -105,6 +148,30 @@ class IBUFull(IBUBase):
             print("Setting counts distribution...")
         self._obs = obs_vec
 
+    def set_obs_batch(self, obs: Union[List[dict], np.ndarray, jnp.ndarray]):
+        """
+            Sets a batch of observed counts (e.g. one per timestep) to be
+            unfolded together by train_batch(). Every entry must be over the
+            same number of qubits.
+        :param obs: a list of dicts mapping bitstrings to counts, or a
+        [batch, 2**num_qubits, 1] numpy/jax array of (log) probabilities.
+        """
+        if type(obs) == list or type(obs) == tuple:
+            if self.verbose:
+                print(f"Converting {len(obs)} dictionaries of counts to "
+                      f"vectors...")
+            obs_vecs = [counts_to_vec_full(o) for o in obs]
+            obs_vecs = [o / np.sum(o) for o in obs_vecs]
+            obs_batch = np.stack(obs_vecs)
+            if self.use_log:
+                obs_batch = np.log(obs_batch)
+        else:
+            obs_batch = obs
+
+        if self.library == 'jax':
+            obs_batch = jnp.asarray(obs_batch)
+        self._obs_batch = obs_batch
+
     def generate_obs(self, t_raw: Union[np.ndarray, jnp.ndarray, tf.Tensor]) \
             -> Union[np.ndarray, jnp.ndarray, tf.Tensor]:
         """
@@ -199,9 +266,9 @@ class IBUFull(IBUBase):
         """
             Dispatcher for fast matrix multiplication with a vector when the
             matrix is the kronecker product of N sub-matrices of identical
-            dimension. jax/tensorflow supported, numpy not supported currently.
+            dimension. jax/tensorflow/numpy supported.
 
-        :param mat: a [N, 2, 2]-array (jax/tensorflow) of N-qubit ops
+        :param mat: a [N, 2, 2]-array (jax/tensorflow/numpy) of N-qubit ops
         :param vec: a [2**N, 1]-array
         :return: the product mat @ vec
         """
@@ -217,7 +284,6 @@ class IBUFull(IBUBase):
 
         return result
 
-    @tf.function
     def _kron_matmul_tf(self, mat: tf.Tensor,
                         vec: tf.linalg.LinearOperatorKronecker) -> tf.Tensor:
         """
@@ -239,14 +305,15 @@ class IBUFull(IBUBase):
 
         return result
 
-    @partial(jit, static_argnums=(0,))
+    @partial(lazy_jit, static_argnums=(0,))
     def _kron_matmul_jax(self, mat: jnp.ndarray, vec: jnp.ndarray) \
             -> jnp.ndarray:
         """
             Fast matrix multiplication (jax) with a vector when the matrix is
             the kronecker product of N sub-matrices of identical dimension.
 
-        :param mat: a [N, 2, 2]-jax ndarray of N-qubit ops
+        :param mat: a [N, 2, 2]-jax ndarray of N-qubit ops (or a tuple of
+                    block ops, with "blocks" in the params)
         :param vec: a [2**N, 1]-jax ndarray
         :return: the product mat @ vec
         """
@@ -258,6 +325,13 @@ class IBUFull(IBUBase):
             max_vec = None
             exp_vec = vec
 
+        if self._blocks is not None:
+            from ibu_src.kron_matmul import block_kron_matmul
+            result = block_kron_matmul(self._blocks, mat, exp_vec, jnp)
+            if self.use_log:
+                result = jnp.log(result) + max_vec
+            return result
+
         result = jnp.transpose(exp_vec)
         for i in jnp.arange(mat.shape[0] - 1, -1, -1):
             op = mat[i, :, :]
@@ -273,8 +347,42 @@ class IBUFull(IBUBase):
 
         return result
 
-    def _kron_matmul_numpy(self, mat: np.ndarray, vec: np.ndarray):
-        raise NotImplementedError
+    def _kron_matmul_numpy(self, mat: np.ndarray, vec: np.ndarray) \
+            -> np.ndarray:
+        """
+            Fast matrix multiplication (numpy) with a vector when the matrix is
+            the kronecker product of N sub-matrices of identical dimension.
+            Same algorithm as _kron_matmul_jax(): each op is contracted with
+            the last qubit axis of the reshaped vector, which rotates the
+            qubit axes so that the next op lines up with the new last axis.
+
+        :param mat: a [N, 2, 2]-numpy ndarray of N-qubit ops (or a tuple of
+                    block ops, with "blocks" in the params)
+        :param vec: a [2**N, 1]-numpy ndarray
+        :return: the product mat @ vec
+        """
+
+        if self.use_log:
+            max_vec = np.max(vec)
+            exp_vec = np.exp(vec - max_vec)
+        else:
+            max_vec = None
+            exp_vec = vec
+
+        if self._blocks is not None:
+            from ibu_src.kron_matmul import block_kron_matmul
+            result = block_kron_matmul(self._blocks, mat, exp_vec, np)
+        else:
+            result = exp_vec
+            for i in range(mat.shape[0] - 1, -1, -1):
+                result = np.reshape(result, (-1, 2))  # 2**n-1 x 2
+                result = np.tensordot(mat[i], result, axes=([1], [1]))  # 2 x 2**n-1
+            result = np.reshape(result, exp_vec.shape)
+
+        if self.use_log:
+            result = np.log(result) + max_vec
+
+        return result
 
     ############################################################################
     #                               TRAIN
@@ -301,6 +409,8 @@ class IBUFull(IBUBase):
                   (if provided), either as probability assigned to "right"
                   answer or as norm error from correct solution
         """
+        if self._compiled:
+            return self._train_compiled(max_iters, tol, soln)
 
         tracker = self.initialize_tracker(max_iters)
 
@@ -324,8 +434,169 @@ class IBUFull(IBUBase):
                 print("Waiting for JAX to return control flow...")
             tracker.block_until_ready()
 
+        self.record_updates(iteration)
         return self.guess, iteration, tracker[:iteration + 1, 0]
 
+    def train_batch(self, max_iters: int = 100, tol: float = 1e-4,
+                    mats_batch: Union[None, List[List[np.ndarray]]] = None,
+                    init: Union[None, np.ndarray, jnp.ndarray] = None) \
+            -> Tuple[jnp.ndarray, jnp.ndarray]:
+        """
+            Train IBU on every entry of the batch given to set_obs_batch() at
+            once, with a single vectorized (vmapped) update per iteration
+            instead of one IBU object per entry. Each entry halts on its own
+            once its update difference drops below tol, so the per-entry
+            solutions and iteration counts match those of train().
+            Only jax is currently supported.
+        :param max_iters: maximum number of iterations to run IBU for
+        :param tol: tolerance for convergence of each batch entry
+        :param mats_batch: (optional) one list of 2x2 single-qubit error
+                           matrices per batch entry, for when entries were
+                           measured on different qubits; defaults to the
+                           matrices given at instantiation for every entry
+        :param init: (optional) a [batch, 2**num_qubits, 1] initial guess;
+                     defaults to the uniform distribution for every entry
+        :return: a 2-tuple:
+                - the [batch, 2**num_qubits, 1] solutions (as jax array)
+                - the # iterations run for each batch entry
+        """
+        if self.library != 'jax':
+            raise NotImplementedError("Batched IBU is only supported with "
+                                      "jax!")
+
+        batch_size = self._obs_batch.shape[0]
+        if mats_batch is not None and self._blocks is not None:
+            raise NotImplementedError("Per-entry matrices are not supported "
+                                      "with block readout models!")
+        if mats_batch is None:
+            mats, matsT = self._mats, self._matsT
+        else:
+            mats = jnp.array([self.mats_to_kronstruct(m, transpose=False)
+                              for m in mats_batch])
+            matsT = jnp.transpose(mats, (0, 1, 3, 2))
+
+        if init is None:
+            init = unif_dense(2 ** self.num_qubits, library=self.library,
+                              use_log=self.use_log)
+            guesses = jnp.broadcast_to(init, (batch_size,) + init.shape)
+        else:
+            guesses = jnp.asarray(init)
+
+        active = jnp.ones(batch_size, dtype=bool)
+        iterations = jnp.zeros(batch_size, dtype=int)
+
+        if self._compiled:
+            guesses, iterations = self._train_loop_jax_batch(
+                mats, matsT, guesses, self._obs_batch, iterations, active,
+                tol, max_iters)
+            self._guess_batch = guesses.block_until_ready()
+            self.record_updates(iterations)
+            return self._guess_batch, iterations
+
+        iteration = 0
+        if self.verbose:
+            pbar = tqdm(total=max_iters, desc='Batched IBU Iteration')
+        else:
+            pbar = None
+
+        while iteration < max_iters and bool(jnp.any(active)):
+            guesses, iterations, active = self._train_iter_jax_batch(
+                mats, matsT, guesses, self._obs_batch, iterations, active, tol)
+            iteration += 1
+            if self.verbose:
+                pbar.update()
+
+        self._guess_batch = guesses.block_until_ready()
+        self.record_updates(iterations)
+        return self._guess_batch, iterations
+
+    def _train_compiled(self, max_iters: int, tol: float,
+                        soln: Union[dict, List[str], jnp.ndarray] = None) \
+            -> Tuple[jnp.ndarray, int, jnp.ndarray]:
+        """
+            Train IBU with the whole loop (update, convergence test and
+            tracker logging) compiled into a single on-device jax while loop,
+            so the host only syncs once, after convergence. Selected by setting
+            "compiled" to True in the params dict. See train() for the inputs
+            and outputs.
+        """
+        if self.library != 'jax':
+            raise NotImplementedError("Compiled training is only supported "
+                                      "with jax!")
+
+        soln_mode, soln_vec = self.soln_to_vec(soln)
+        tracker = self.initialize_tracker(max_iters)
+
+        self._guess, iteration, tracker = self._train_loop_jax(
+            self._mats, self._matsT, self._guess, self._obs, tracker, tol,
+            max_iters, soln_vec, soln_mode)
+        iteration = int(iteration)
+
+        self.record_updates(iteration)
+        return self.guess, iteration, tracker[:iteration + 1, 0]
+
+    @partial(lazy_jit, static_argnums=(0, 9))
+    def _train_loop_jax(self, mats: jnp.ndarray, matsT: jnp.ndarray,
+                        guess: jnp.ndarray, obs: jnp.ndarray,
+                        tracker: jnp.ndarray, tol: float, max_iters: int,
+                        soln_vec: jnp.ndarray, soln_mode: Union[None, str]) \
+            -> Tuple[jnp.ndarray, jnp.ndarray, jnp.ndarray]:
+        """
+            The jax while loop behind _train_compiled(); mirrors the loop in
+            train() iteration for iteration.
+        :param soln_vec: the solution as given by soln_to_vec()
+        :param soln_mode: the tracking mode as given by soln_to_vec()
+        :return: the final guess, # iterations and the filled tracker
+        """
+        def log(tracker, guess, idx):
+            if soln_mode is None:
+                return tracker
+            return tracker.at[idx].set(
+                self._performance_jax(guess, soln_vec, soln_mode))
+
+        def cond(carry):
+            iteration, diff, _, _ = carry
+            return (iteration < max_iters) & (diff > tol)
+
+        def body(carry):
+            iteration, _, guess, tracker = carry
+            tracker = log(tracker, guess, iteration)
+            guess, diff = self._step_jax(mats, matsT, guess, obs)
+            return iteration + 1, diff, guess, tracker
+
+        iteration, _, guess, tracker = jax.lax.while_loop(
+            cond, body, (0, jnp.inf, guess, tracker))
+        tracker = log(tracker, guess, iteration)
+
+        return guess, iteration, tracker
+
+    @partial(lazy_jit, static_argnums=(0,))
+    def _train_loop_jax_batch(self, mats: jnp.ndarray, matsT: jnp.ndarray,
+                              guesses: jnp.ndarray, obs: jnp.ndarray,
+                              iterations: jnp.ndarray, active: jnp.ndarray,
+                              tol: float, max_iters: int) \
+            -> Tuple[jnp.ndarray, jnp.ndarray]:
+        """
+            Compiled counterpart of the loop in train_batch(); runs
+            _train_iter_jax_batch() in a jax while loop until every entry has
+            converged or max_iters is reached.
+        :return: the final guesses and # iterations run for each entry
+        """
+        def cond(carry):
+            iteration, _, _, active = carry
+            return (iteration < max_iters) & jnp.any(active)
+
+        def body(carry):
+            iteration, guesses, iterations, active = carry
+            guesses, iterations, active = self._train_iter_jax_batch(
+                mats, matsT, guesses, obs, iterations, active, tol)
+            return iteration + 1, guesses, iterations, active
+
+        _, guesses, iterations, _ = jax.lax.while_loop(
+            cond, body, (0, guesses, iterations, active))
+
+        return guesses, iterations
+
     def train_iter(self) -> float:
         """
             Dispatcher for IBU iteration
@@ -336,10 +607,11 @@ class IBUFull(IBUBase):
             return self._train_iter_tf()
         elif self.library == 'jax':
             return self._train_iter_jax()
+        elif self.library == 'numpy':
+            return self._train_iter_numpy()
         else:
             raise "Unsupported library!"
 
-    @tf.function
     def _train_iter_tf(self) -> float:
         """
             A single (tensorflow) iteration of IBU
@@ -372,6 +644,11 @@ class IBUFull(IBUBase):
         :return: the norm difference between the updated parameters and previous
                  parameters
         """
+        if self._accel is not None:
+            self._guess, diff = self._step_jax(self._mats, self._matsT,
+                                               self._guess, self._obs)
+            return diff
+
         # Compute renormalizer P(o) needed to compute P(t|o)
         obs_guess = self._kron_matmul_jax(self.mats, self._guess)
 
@@ -394,6 +671,196 @@ class IBUFull(IBUBase):
 
         return diff
 
+    def _train_iter_numpy(self) -> float:
+        """
+            A single (numpy) iteration of IBU
+        :return: the norm difference between the updated parameters and previous
+                 parameters
+        """
+        if self._accel is not None:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self._guess, diff = squarem_step(
+                    lambda g: self._update_numpy(self._mats, self._matsT, g,
+                                                 self._obs),
+                    lambda g: obs_loglik(
+                        self._obs, self._kron_matmul_numpy(self._mats, g), np),
+                    self._guess, np)
+            return diff
+
+        self._guess, diff = self._update_numpy(self._mats, self._matsT,
+                                               self._guess, self._obs)
+        return diff
+
+    def _update_numpy(self, mats: np.ndarray, matsT: np.ndarray,
+                      guess: np.ndarray, obs: np.ndarray) \
+            -> Tuple[np.ndarray, float]:
+        """
+            A single functional (numpy) iteration of IBU on an explicit guess
+            and observation vector; see _update_jax().
+        :return: the updated guess and the norm difference between the updated
+                 guess and the previous guess
+        """
+        # Compute renormalizer P(o) needed to compute P(t|o)
+        obs_guess = self._kron_matmul_numpy(mats, guess)
+
+        # Update estimate of P(t)
+        if self.use_log:
+            # if priors have 0, log will take them to inf; be careful
+            # if adding/subtracting from infinity!
+            eq1 = np.nan_to_num(obs - obs_guess)
+            eq2 = self._kron_matmul_numpy(matsT, eq1)
+            diff = np.linalg.norm(np.exp(guess + eq2) - np.exp(guess), ord=1)
+            guess = guess + eq2
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                eq1 = np.nan_to_num(np.divide(obs, obs_guess))
+            eq2 = self._kron_matmul_numpy(matsT, eq1)
+            diff = np.linalg.norm((guess * eq2) - guess, ord=1)
+            guess = guess * eq2
+
+        return guess, diff
+
+    def _update_jax(self, mats: jnp.ndarray, matsT: jnp.ndarray,
+                    guess: jnp.ndarray, obs: jnp.ndarray) \
+            -> Tuple[jnp.ndarray, jnp.ndarray]:
+        """
+            A single functional (jax) iteration of IBU on an explicit guess and
+            observation vector, so that it can be vmapped over a batch.
+        :return: the updated guess and the norm difference between the updated
+                 guess and the previous guess
+        """
+        obs_guess = self._kron_matmul_jax(mats, guess)
+
+        if self.use_log:
+            eq1 = jnp.nan_to_num(obs - obs_guess)
+            eq2 = self._kron_matmul_jax(matsT, eq1)
+            diff = jnp.linalg.norm(jnp.exp(guess + eq2) - jnp.exp(guess),
+                                   ord=1)
+            guess = guess + eq2
+        else:
+            eq1 = jnp.nan_to_num(jnp.divide(obs, obs_guess))
+            eq2 = self._kron_matmul_jax(matsT, eq1)
+            diff = jnp.linalg.norm((guess * eq2) - guess, ord=1)
+            guess = guess * eq2
+
+        return guess, diff
+
+    def _step_jax(self, mats: jnp.ndarray, matsT: jnp.ndarray,
+                  guess: jnp.ndarray, obs: jnp.ndarray) \
+            -> Tuple[jnp.ndarray, jnp.ndarray]:
+        """
+            A single functional (jax) step of training: a plain IBU update, or
+            a SQUAREM cycle of IBU updates if "accel" is set in the params.
+        :return: the new guess and the norm difference of the (first) plain
+                 update
+        """
+        if self._accel is None:
+            return self._update_jax(mats, matsT, guess, obs)
+        return squarem_step(
+            lambda g: self._update_jax(mats, matsT, g, obs),
+            lambda g: obs_loglik(obs, self._kron_matmul_jax(mats, g), jnp),
+            guess, jnp)
+
+    @partial(lazy_jit, static_argnums=(0,))
+    def _train_iter_jax_batch(self, mats: jnp.ndarray, matsT: jnp.ndarray,
+                              guesses: jnp.ndarray, obs: jnp.ndarray,
+                              iterations: jnp.ndarray, active: jnp.ndarray,
+                              tol: float) \
+            -> Tuple[jnp.ndarray, jnp.ndarray, jnp.ndarray]:
+        """
+            A single (jax) iteration of IBU over a whole batch. Entries that
+            have already converged are left untouched.
+        :param mats: a [N, 2, 2] jax ndarray shared by all entries, or a
+                     [batch, N, 2, 2] jax ndarray of per-entry ops
+        :param matsT: the transpose of each op in mats
+        :param guesses: a [batch, 2**N, 1] jax ndarray of current guesses
+        :param obs: a [batch, 2**N, 1] jax ndarray of observed distributions
+        :param iterations: the # iterations run so far for each entry
+        :param active: whether each entry has yet to converge
+        :param tol: tolerance for convergence
+        :return: the updated guesses, iteration counts and active mask
+        """
+        mats_axis = 0 if self._blocks is None and mats.ndim == 4 else None
+        updated, diffs = jax.vmap(self._step_jax,
+                              in_axes=(mats_axis, mats_axis, 0, 0))(
+            mats, matsT, guesses, obs)
+
+        guesses = jnp.where(active[:, None, None], updated, guesses)
+        iterations = iterations + active
+        active = active & (diffs > tol)
+
+        return guesses, iterations, active
+
+    def record_updates(self, iterations: Union[int, jnp.ndarray]):
+        """
+            Record in self.updates the number of plain IBU updates performed
+            by training: one per iteration, or UPDATES_PER_CYCLE per SQUAREM
+            cycle (a cycle that falls back to its plain updates still ran all
+            of them). A list with one count per batch entry for train_batch().
+        :param iterations: the # iterations (or SQUAREM cycles) run, for each
+                           batch entry for train_batch()
+        """
+        updates = np.asarray(iterations)
+        if self._accel is not None:
+            updates = UPDATES_PER_CYCLE * updates
+        self.updates = updates.tolist()
+
+    def benchmark_accel(self, max_iters: int = 100, tol: float = 1e-4,
+                        init: Union[None, np.ndarray, jnp.ndarray] = None,
+                        mats_batch: Union[None, List[List[np.ndarray]]] = None) \
+            -> Union[int, List[int]]:
+        """
+            Benchmark SQUAREM acceleration after train() or train_batch():
+            rerun plain IBU from the same starting guess(es) and compare its
+            iterations with the updates recorded in self.updates. The savings
+            are returned and stored in self.iterations_saved. Training never
+            runs this extra solve itself.
+        :param max_iters: maximum number of plain iterations to run
+        :param tol: tolerance for convergence, as given to training
+        :param init: (optional) the starting guess(es) given to train_batch();
+                     defaults to the uniform distribution for batches and to
+                     the initial guess of train() otherwise
+        :param mats_batch: (optional) per-entry error matrices, as given to
+                           train_batch()
+        :return: the # IBU iterations saved (for each batch entry)
+        """
+        if self.updates is None:
+            raise ValueError("Train IBU before benchmarking it!")
+
+        update = (self._update_numpy, self._update_jax)[self.library == 'jax']
+        batched = isinstance(self.updates, list)
+        if not batched:
+            starts, obss = [self._init], [self._obs]
+        else:
+            obss = self._obs_batch
+            if init is None:
+                init = unif_dense(2 ** self.num_qubits, library=self.library,
+                                  use_log=self.use_log)
+                starts = [init] * obss.shape[0]
+            else:
+                starts = init
+
+        plain = []
+        for i in range(len(obss)):
+            if mats_batch is None:
+                mats, matsT = self._mats, self._matsT
+            else:
+                mats = self.mats_to_kronstruct(mats_batch[i], transpose=False)
+                matsT = self.mats_to_kronstruct(mats_batch[i], transpose=True)
+            guess, diff, iteration = starts[i], tol + 1, 0
+            while iteration < max_iters and diff > tol:
+                guess, diff = update(mats, matsT, guess, obss[i])
+                iteration += 1
+            plain.append(iteration)
+
+        saved = (np.asarray(plain) - np.asarray(self.updates)).tolist()
+        self.iterations_saved = saved if batched else saved[0]
+        if self.verbose:
+            plain = plain if batched else plain[0]
+            print(f"{self.updates} IBU updates vs {plain} plain IBU "
+                  f"iterations; {self.iterations_saved} saved.")
+        return self.iterations_saved
+
     ############################################################################
     #                                LOGGING
     ############################################################################
@@ -407,7 +874,7 @@ class IBUFull(IBUBase):
         :return: a jax ndarray/tensorflow tensor of zeros
         """
 
-        if self.library == 'tensorflow':
+        if self.library == 'tensorflow' or self.library == 'numpy':
             return np.zeros([max_iters, 1])
         elif self.library == 'jax':
             return jnp.zeros([max_iters, 1])
@@ -441,11 +908,58 @@ class IBUFull(IBUBase):
                 tracker[idx] = float(res)
             elif self.library == 'jax':
                 tracker = tracker.at[idx].set(res)
+            elif self.library == 'numpy':
+                # The final log after max_iters iterations has no slot
+                if idx < tracker.shape[0]:
+                    tracker[idx] = float(res)
             else:
                 raise "Unsupported Library!"
 
         return tracker
 
+    def soln_to_vec(self, soln: Union[None, dict, List[str], jnp.ndarray]) \
+            -> Tuple[Union[None, str], Union[None, jnp.ndarray]]:
+        """
+            Converts a solution (as accepted by log_performance()) to a dense
+            2**num_qubits x 1 vector, so performance can be logged inside a
+            compiled training loop.
+        :param soln: the solution (either list of correct keys/true prob vec/
+                     dict of keys and true probs)
+        :return: a 2-tuple:
+                - the tracking mode: None (no soln), "prob" (soln is a 0/1
+                  mask of the correct bitstrings) or "l1" (soln is the true
+                  probability vector, NOT in log space)
+                - the solution vector
+        """
+        if soln is None:
+            return None, None
+
+        if type(soln) == list or type(soln) == tuple:
+            soln_vec = np.zeros([2 ** self.num_qubits, 1])
+            for sol in soln:
+                soln_vec[int(sol[::-1], 2)] = 1
+            return "prob", jnp.array(soln_vec)
+
+        if type(soln) == dict:
+            soln_vec = np.zeros([2 ** self.num_qubits, 1])
+            for key, val in soln.items():
+                soln_vec[int(key[::-1], 2)] = (val, np.exp(val))[self.use_log]
+            return "l1", jnp.array(soln_vec)
+
+        soln_vec = (jnp.asarray(soln), jnp.exp(soln))[self.use_log]
+        return "l1", soln_vec.reshape(-1, 1)
+
+    def _performance_jax(self, guess: jnp.ndarray, soln_vec: jnp.ndarray,
+                         soln_mode: str) -> jnp.ndarray:
+        """
+            Traceable equivalent of get_prob()/get_l1_error(), for solutions
+            converted with soln_to_vec().
+        """
+        probs = (guess, jnp.exp(guess))[self.use_log]
+        if soln_mode == "prob":
+            return jnp.sum(probs * soln_vec)
+        return jnp.linalg.norm(probs - soln_vec, ord=1)
+
     def get_prob(self, soln: List[str]):
         """
             Given a list of bitstrings, returns the total probability assigned
@@ -470,6 +984,11 @@ class IBUFull(IBUBase):
                 else:
                     prob += self._guess[int(sol[::-1], 2)]
             return prob[0, 0]
+        elif self.library == 'numpy':
+            inds = [int(sol[::-1], 2) for sol in soln]
+            if self.use_log:
+                return float(np.sum(np.exp(self._guess[inds])))
+            return float(np.sum(self._guess[inds]))
         else:
             raise "Unsupported Library!"
 
@@ -514,6 +1033,16 @@ class IBUFull(IBUBase):
                 else:
                     err = tf.linalg.norm(self.guess - soln, ord=1)
 
+        elif self.library == 'numpy':
+            guess_copy = (np.copy(self.guess), np.exp(self.guess))[self.use_log]
+            if type(soln) == dict:
+                for key, val in soln.items():
+                    soln_prob = (val, np.exp(val))[self.use_log]
+                    guess_copy[int(key[::-1], 2)] -= soln_prob
+            else:
+                guess_copy -= (soln, np.exp(soln))[self.use_log]
+            err = np.linalg.norm(guess_copy, ord=1)
+
         else:
             raise "Unrecognized library!"
 
@@ -546,6 +1075,13 @@ class IBUFull(IBUBase):
                 guess_cp[rev_key].assign(guess_cp[rev_key] + soln_prob)
             err = tf.linalg.norm(guess_cp, ord=np.inf)
 
+        elif self.library == 'numpy':
+            guess_copy = (np.copy(self.guess), np.exp(self.guess))[self.use_log]
+            for key, val in soln.items():
+                soln_prob = (val, np.exp(val))[self.use_log]
+                guess_copy[int(key[::-1], 2)] -= soln_prob
+            err = np.linalg.norm(guess_copy, ord=np.inf)
+
         else:
             raise "Unrecognized library!"
 
@@ -559,13 +1095,18 @@ class IBUFull(IBUBase):
             -> Union[jnp.ndarray, tf.linalg.LinearOperatorKronecker]:
         """
             Helper function to convert list of numpy matrices of single-qubit
-            error probabilities to jax/tensorflow tensor.
+            error probabilities to jax/tensorflow/numpy tensor.
         :param mats_raw: list of 2x2 numpy arrays of single-qubit error
          probabilities, in reverse order their respective qubits appear in
          bitstrings.
         :param transpose: whether to transpose each matrix
-        :return: jax ndarray or tensorflow LinearOperatorKronecker
+        :return: jax/numpy ndarray or tensorflow LinearOperatorKronecker (or
+                 a tuple of jax/numpy block ops, with "blocks" in the params)
         """
+        if self._blocks is not None:
+            xp = (np, jnp)[self.library == 'jax']
+            return tuple(xp.array(mat.transpose() if transpose else mat)
+                         for mat in mats_raw)
 
         if self.library == 'tensorflow':
             if transpose:
@@ -581,6 +1122,11 @@ class IBUFull(IBUBase):
                 kronmats = jnp.array([mat.transpose() for mat in mats_raw])
             else:
                 kronmats = jnp.array(mats_raw)
+        elif self.library == 'numpy':
+            if transpose:
+                kronmats = np.array([mat.transpose() for mat in mats_raw])
+            else:
+                kronmats = np.array(mats_raw)
         else:
             raise "Unsupported library!"
 
@@ -1,8 +1,11 @@
+from __future__ import annotations
 from ibu_src.IBUBase import IBUBase
 from collections import namedtuple
 from typing import NamedTuple, Union
 from ibu_utils.data_utils import *
 from ibu_src.kron_matmul import *
+from ibu_utils.lazy_utils import LazyModule, lazy_jit
+from ibu_src.squarem import squarem_step, obs_loglik, UPDATES_PER_CYCLE
 from functools import partial
 from tqdm import tqdm
 
@@ -15,10 +18,22 @@ class IBUReduced(IBUBase):
         self._num_qubits = params['num_qubits']
         self._library = params['library']
         self._use_log = params['use_log']
+        self._compiled = params.get('compiled', False)
+        self._accel = params.get('accel', None)
         self.mem_constrained = mem_constrained
 
         self._verbose = params['verbose']
 
+        if self._accel is not None:
+            if self._accel != 'squarem':
+                raise NotImplementedError(f"Unknown acceleration "
+                                          f"{self._accel}!")
+            if self._use_log:
+                raise NotImplementedError("SQUAREM acceleration is not "
+                                          "supported in log space!")
+        self.updates = None
+        self.iterations_saved = None
+
         self._mats = self.mats_to_kronstruct(mats_raw)
         self._obs = None
         self._init = None
@@ -286,6 +301,9 @@ class IBUReduced(IBUBase):
                   (if provided), either as probability assigned to "right"
                   answer or as norm error from correct solution
         """
+        if self._compiled:
+            return self._train_compiled(max_iters, tol, soln, hd_reduce)
+
         tracker = self.initialize_tracker(max_iters)
 
         iteration = 0
@@ -313,8 +331,101 @@ class IBUReduced(IBUBase):
             if self.verbose:
                 print("Waiting for JAX to return control flow...")
             tracker.block_until_ready()
+        self.record_updates(iteration)
+        return self.guess, iteration, tracker[:iteration + 1, 0]
+
+    def _train_compiled(self, max_iters: int, tol: float,
+                        soln: Union[None, list, dict] = None,
+                        hd_reduce: Tuple[int, int] = (None, None)) \
+            -> Tuple[jnp.ndarray, int, jnp.ndarray]:
+        """
+            Train IBU with the whole loop (update, convergence test and
+            tracker logging) compiled into a single on-device jax while loop,
+            so the host only syncs once, after convergence. Selected by setting
+            "compiled" to True in the params dict. When hd_reduce narrows the
+            tracked bitstrings mid-training, the loop is split in two around
+            the reduction. See train() for the inputs and outputs.
+        """
+        if self.library != 'jax':
+            raise NotImplementedError("Compiled training is only supported "
+                                      "with jax!")
+
+        tracker = self.initialize_tracker(max_iters)
+        if hd_reduce[0] is not None and hd_reduce[0] == -1:
+            self.reduce_to_top_guess(hd_reduce[1])
+
+        iteration, diff = 0, jnp.inf
+        if hd_reduce[0] is not None and hd_reduce[0] >= 0:
+            # Run up to and including the iteration after which to reduce
+            stop = min(max_iters, hd_reduce[0] + 1)
+            soln_mode, soln_vec, soln_res = self.soln_to_vec(soln)
+            self._guess, iteration, diff, tracker = self._train_loop_jax(
+                self._mats, self._guess, self._obs.exp_mat, self._obs.obs_mat,
+                self._obs.obs_vec, tracker, iteration, diff, tol, stop,
+                soln_vec, soln_res, soln_mode)
+            if int(iteration) == hd_reduce[0] + 1:
+                self.reduce_to_top_guess(hd_reduce[1])
+
+        # soln must be re-encoded after any reduction of the tracked bitstrings
+        soln_mode, soln_vec, soln_res = self.soln_to_vec(soln)
+        self._guess, iteration, diff, tracker = self._train_loop_jax(
+            self._mats, self._guess, self._obs.exp_mat, self._obs.obs_mat,
+            self._obs.obs_vec, tracker, iteration, diff, tol, max_iters,
+            soln_vec, soln_res, soln_mode)
+        iteration = int(iteration)
+
+        self.record_updates(iteration)
         return self.guess, iteration, tracker[:iteration + 1, 0]
 
+    @partial(lazy_jit, static_argnums=(0, 13))
+    def _train_loop_jax(self, mats: jnp.ndarray, guess: jnp.ndarray,
+                        exp_mat: jnp.ndarray, obs_mat: jnp.ndarray,
+                        obs_vec: jnp.ndarray, tracker: jnp.ndarray,
+                        iteration: int, diff: float, tol: float,
+                        max_iters: int, soln_vec: jnp.ndarray,
+                        soln_res: float, soln_mode: Union[None, str]) \
+            -> Tuple[jnp.ndarray, jnp.ndarray, jnp.ndarray, jnp.ndarray]:
+        """
+            The jax while loop behind _train_compiled(); mirrors the loop in
+            train() iteration for iteration, starting from the given iteration
+            and update difference.
+        :param soln_vec: the solution as given by soln_to_vec()
+        :param soln_res: the residual error as given by soln_to_vec()
+        :param soln_mode: the tracking mode as given by soln_to_vec()
+        :return: the final guess, # iterations, last update difference and the
+                 filled tracker
+        """
+        if self.use_log:
+            iter_fn = (self._train_iter_jax_log_fast,
+                       self._train_iter_jax_log_compact)[self.mem_constrained]
+        else:
+            iter_fn = (self._train_iter_jax_fast,
+                       self._train_iter_jax_compact)[self.mem_constrained]
+
+        def log(tracker, guess, idx):
+            if soln_mode is None:
+                return tracker
+            return tracker.at[idx].set(
+                self._performance_jax(guess, soln_vec, soln_res, soln_mode))
+
+        def cond(carry):
+            iteration, diff, _, _ = carry
+            return (iteration < max_iters) & (diff > tol)
+
+        def body(carry):
+            iteration, _, guess, tracker = carry
+            tracker = log(tracker, guess, iteration)
+            guess, diff = self._step_jax(iter_fn, mats, guess, exp_mat,
+                                         obs_mat, obs_vec)
+            return iteration + 1, diff, guess, tracker
+
+        iteration, diff, guess, tracker = jax.lax.while_loop(
+            cond, body, (iteration, jnp.asarray(diff, dtype=guess.dtype),
+                         guess, tracker))
+        tracker = log(tracker, guess, iteration)
+
+        return guess, iteration, diff, tracker
+
     def train_iter(self) -> jnp.float32:
         """
             Dispatcher for IBU iteration based on library (currently on jax is
@@ -323,7 +434,16 @@ class IBUReduced(IBUBase):
                  parameters
         """
         if self.library == 'jax':
-            self._guess, diff = self._train_iter_jax()
+            if self._accel is not None:
+                iter_fn = (self._train_iter_jax_fast,
+                           self._train_iter_jax_compact)[self.mem_constrained]
+                self._guess, diff = self._step_jax(iter_fn, self._mats,
+                                                   self._guess,
+                                                   self._obs.exp_mat,
+                                                   self._obs.obs_mat,
+                                                   self._obs.obs_vec)
+            else:
+                self._guess, diff = self._train_iter_jax()
             return diff
         else:
             raise "Unsupported library!"
@@ -379,7 +499,7 @@ class IBUReduced(IBUBase):
                                                         self._obs.obs_mat,
                                                         self._obs.obs_vec)
 
-    @partial(jit, static_argnums=0)
+    @partial(lazy_jit, static_argnums=0)
     def _train_iter_jax_fast(self, mats: jnp.ndarray, guess: jnp.ndarray,
                              exp_mat: jnp.ndarray, obs_mat: jnp.ndarray,
                              obs_vec: jnp.ndarray) \
@@ -411,7 +531,7 @@ class IBUReduced(IBUBase):
 
         return guess, diff
 
-    @partial(jit, static_argnums=0)
+    @partial(lazy_jit, static_argnums=0)
     def _train_iter_jax_compact(self, mats: jnp.ndarray, guess: jnp.ndarray,
                                 exp_mat: jnp.ndarray, obs_mat: jnp.ndarray,
                                 obs_vec: jnp.ndarray) \
@@ -433,7 +553,7 @@ class IBUReduced(IBUBase):
 
         return guess, diff
 
-    @partial(jit, static_argnums=0)
+    @partial(lazy_jit, static_argnums=0)
     def _train_iter_jax_log_fast(self, mats: jnp.ndarray, guess: jnp.ndarray,
                                  exp_mat: jnp.ndarray, obs_mat: jnp.ndarray,
                                  obs_vec: jnp.ndarray) \
@@ -465,7 +585,7 @@ class IBUReduced(IBUBase):
 
         return guess, diff
 
-    @partial(jit, static_argnums=0)
+    @partial(lazy_jit, static_argnums=0)
     def _train_iter_jax_log_compact(self, mats: jnp.ndarray, guess: jnp.ndarray,
                                     exp_mat: jnp.ndarray, obs_mat: jnp.ndarray,
                                     obs_vec: jnp.ndarray) \
@@ -497,6 +617,63 @@ class IBUReduced(IBUBase):
 
         return guess, diff
 
+    def _step_jax(self, iter_fn, mats: jnp.ndarray, guess: jnp.ndarray,
+                  exp_mat: jnp.ndarray, obs_mat: jnp.ndarray,
+                  obs_vec: jnp.ndarray) -> Tuple[jnp.ndarray, jnp.float32]:
+        """
+            A single step of training: a plain IBU update with iter_fn (one of
+            the _train_iter_jax_* functions), or a SQUAREM cycle of them if
+            "accel" is set in the params.
+        :return: the new guess and the norm difference of the (first) plain
+                 update
+        """
+        if self._accel is None:
+            return iter_fn(mats, guess, exp_mat, obs_mat, obs_vec)
+        kron_matmul = (fast_kron_matmul,
+                       compact_kron_matmul)[self.mem_constrained]
+        return squarem_step(
+            lambda g: iter_fn(mats, g, exp_mat, obs_mat, obs_vec),
+            lambda g: obs_loglik(obs_vec,
+                                 kron_matmul(mats, g, exp_mat, obs_mat), jnp),
+            guess, jnp)
+
+    def record_updates(self, iterations: int):
+        """
+            Record in self.updates the number of plain IBU updates performed
+            by training. See record_updates() in IBUFull.py.
+        """
+        if self._accel is not None:
+            iterations = UPDATES_PER_CYCLE * iterations
+        self.updates = int(iterations)
+
+    def benchmark_accel(self, max_iters: int = 100, tol: float = 1e-4) -> int:
+        """
+            Benchmark SQUAREM acceleration after train(): rerun plain IBU from
+            the same starting guess and return the IBU iterations saved (also
+            stored in self.iterations_saved). Not supported once train() has
+            reduced the tracked bitstrings (hd_reduce). See benchmark_accel()
+            in IBUFull.py.
+        """
+        if self.updates is None:
+            raise ValueError("Train IBU before benchmarking it!")
+        if self._init.shape != self._guess.shape:
+            raise NotImplementedError("Cannot benchmark after reducing the "
+                                      "tracked bitstrings!")
+
+        iter_fn = (self._train_iter_jax_fast,
+                   self._train_iter_jax_compact)[self.mem_constrained]
+        guess, diff, plain = self._init, tol + 1, 0
+        while plain < max_iters and diff > tol:
+            guess, diff = iter_fn(self._mats, guess, self._obs.exp_mat,
+                                  self._obs.obs_mat, self._obs.obs_vec)
+            plain += 1
+
+        self.iterations_saved = plain - self.updates
+        if self.verbose:
+            print(f"{self.updates} IBU updates vs {plain} plain IBU "
+                  f"iterations; {self.iterations_saved} saved.")
+        return self.iterations_saved
+
     ############################################################################
     #                                LOGGING
     ############################################################################
@@ -541,6 +718,53 @@ class IBUReduced(IBUBase):
 
         return tracker
 
+    def soln_to_vec(self, soln: Union[None, list, dict]) \
+            -> Tuple[Union[None, str], Union[None, jnp.ndarray], float]:
+        """
+            Converts a solution (as accepted by log_performance()) to a dense
+            K x 1 vector over the tracked bitstrings, so performance can be
+            logged inside a compiled training loop.
+        :param soln: the solution (either list of correct keys or dictionary
+                     mapping bitstrings to correct probability)
+        :return: a 3-tuple:
+                - the tracking mode: None (no soln), "prob" (soln is a 0/1
+                  mask of the correct bitstrings) or "l1" (soln is the true
+                  probability vector, NOT in log space)
+                - the solution vector
+                - the l1-norm error contributed by solution bitstrings that are
+                  not tracked
+        """
+        if soln is None:
+            return None, None, 0.0
+
+        index = {bitstr: i for i, bitstr in enumerate(self._obs.exp_bitstrs)}
+        soln_vec = np.zeros([len(self._obs.exp_bitstrs), 1])
+        soln_res = 0.0
+        if type(soln) == list or type(soln) == tuple:
+            for sol in soln:
+                if sol in index:
+                    soln_vec[index[sol]] = 1
+            return "prob", jnp.array(soln_vec), soln_res
+
+        for bitstr, val in soln.items():
+            prob = (val, np.exp(val))[self.use_log]
+            if bitstr in index:
+                soln_vec[index[bitstr]] = prob
+            else:
+                soln_res += abs(prob)
+        return "l1", jnp.array(soln_vec), soln_res
+
+    def _performance_jax(self, guess: jnp.ndarray, soln_vec: jnp.ndarray,
+                         soln_res: float, soln_mode: str) -> jnp.ndarray:
+        """
+            Traceable equivalent of get_prob()/get_l1_error(), for solutions
+            converted with soln_to_vec().
+        """
+        probs = (guess, jnp.exp(guess))[self.use_log]
+        if soln_mode == "prob":
+            return jnp.sum(probs * soln_vec)
+        return jnp.sum(jnp.absolute(probs - soln_vec)) + soln_res
+
     def get_prob(self, soln: list) -> jnp.float32:
         """
             Given a list of bitstrings, returns the total probability assigned
@@ -666,18 +890,17 @@ class IBUReduced(IBUBase):
                  obs_mat, exp_bitstrs, exp_mat, obs_vec
         """
         obs_bitstrs = sorted(obs_dict.keys())
-        desc_ham, desc_obs, desc_exp = None, None, None
         if self.verbose:
-            desc_ham = f"Computing strings within Hamming radius {ham_dist}"
-            desc_obs = "Encoding observed bitstrings as matrix"
-            desc_exp = "Encoding expanded set of bitstrings as matrix"
-        exp_bitstrs = expand_strs_by_hamdist(obs_bitstrs, ham_dist,
-                                             desc=desc_ham)
-        exp_bitstrs = sorted(set(obs_bitstrs + exp_bitstrs))
+            print(f"Computing strings within Hamming radius {ham_dist}...")
+        obs_bits = strs_to_bits(obs_bitstrs)
+        exp_bits = expand_bits_by_hamdist(obs_bits, ham_dist)
+        exp_bitstrs = bits_to_strs(exp_bits)
         obs_vec = counts_to_vec_subspace(obs_dict, obs_bitstrs, self.verbose)
         obs_vec = normalize_vec(obs_vec, self.library, self.use_log)
-        obs_mat = strs_to_mat(obs_bitstrs, self.library, desc=desc_obs)
-        exp_mat = strs_to_mat(exp_bitstrs, self.library, desc=desc_exp)
+        if self.verbose:
+            print("Encoding observed and expanded bitstrings as matrices...")
+        obs_mat = bits_to_mat(obs_bits, self.library)
+        exp_mat = bits_to_mat(exp_bits, self.library)
         obs = self.ReducedBitstrs(obs_bitstrs, obs_mat, exp_bitstrs,
                                   exp_mat, obs_vec)
 
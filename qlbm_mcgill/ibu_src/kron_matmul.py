@@ -1,10 +1,15 @@
-import jax.numpy as jnp
-from jax import jit, vmap
+from __future__ import annotations
+from ibu_utils.lazy_utils import LazyModule, lazy_jit, lazy_vmap
 from functools import partial
-import jax
+from typing import Sequence, Tuple
 
+# jax is only imported once a jax function is called, so block_kron_matmul
+# can be used with numpy without importing it
+jax = LazyModule("jax")
+jnp = LazyModule("jax.numpy")
 
-@partial(vmap, in_axes=(None, 0, None))
+
+@partial(lazy_vmap, in_axes=(None, 0, None))
 def get_row(ops: jnp.ndarray, inp_ind: jnp.ndarray,
             out_ind: jnp.ndarray,) -> jnp.ndarray:
     """
@@ -26,8 +31,8 @@ def get_row(ops: jnp.ndarray, inp_ind: jnp.ndarray,
     return jnp.prod(ops[jnp.arange(inp_ind.shape[0]), out_ind, inp_ind])
 
 
-@jit
-@partial(vmap, in_axes=(None, None, None, 0))
+@lazy_jit
+@partial(lazy_vmap, in_axes=(None, None, None, 0))
 def fast_kron_matmul(ops: jnp.ndarray, state: jnp.ndarray,
                      inp_inds: jnp.ndarray,
                      out_inds: jnp.ndarray) -> jnp.ndarray:
@@ -55,7 +60,7 @@ def fast_kron_matmul(ops: jnp.ndarray, state: jnp.ndarray,
     return jnp.dot(get_row(ops, inp_inds, out_inds), state)
 
 
-@jit
+@lazy_jit
 def _kron_matmul_row_first(ops: jnp.ndarray, state: jnp.ndarray,
                            inp_inds: jnp.ndarray,
                            out_inds: jnp.ndarray) -> jnp.ndarray:
@@ -72,7 +77,7 @@ def _kron_matmul_row_first(ops: jnp.ndarray, state: jnp.ndarray,
                        out_inds)
 
 
-@partial(vmap, in_axes=(None, None, 0))
+@partial(lazy_vmap, in_axes=(None, None, 0))
 def get_col(ops: jnp.ndarray, inp_ind: jnp.ndarray,
             out_ind: jnp.ndarray) -> jnp.ndarray:
     """
@@ -84,7 +89,7 @@ def get_col(ops: jnp.ndarray, inp_ind: jnp.ndarray,
     return jnp.prod(ops[jnp.arange(inp_ind.shape[0]), out_ind, inp_ind])
 
 
-@jit
+@lazy_jit
 def compact_kron_matmul(ops: jnp.ndarray,
                         state: jnp.ndarray,
                         inp_inds: jnp.ndarray,
@@ -105,3 +110,36 @@ def compact_kron_matmul(ops: jnp.ndarray,
 
     return jax.lax.scan(scanner, jnp.zeros([out_inds.shape[0], 1]),
                         jnp.hstack([inp_inds, state]))[0]
+
+
+def block_kron_matmul(blocks: Tuple[Tuple[int, ...], ...], ops: Sequence,
+                      state, xp=jnp):
+    """
+        Multiplies ops @ state, where the full 2^N x 2^N measurement error
+        matrix is the Kronecker product of blocks of correlated qubits (e.g.
+        neighbouring pairs or triples) instead of single qubits. The state is
+        viewed as an N-dimensional [2, ..., 2] tensor, whose i-th axis is the
+        qubit of the i-th op in an N x 2 x 2 single-qubit decomposition, and
+        each block's op is contracted with the axes of its qubits. Written
+        against the shared numpy/jax.numpy API, so it runs in either library
+        (and traces under jit, as long as blocks is static).
+
+    :param blocks: the qubits of each block, as axes of the state tensor; the
+                   blocks must cover every qubit exactly once
+    :param ops: one 2^b x 2^b op per block of b qubits, whose rows/columns
+                index the block's qubits in the order given in blocks (first
+                qubit as most significant bit)
+    :param state: a 2^N x K array (K vectors multiplied at once)
+    :param xp: the array module of state (numpy or jax.numpy)
+    :return: a 2^N x K array
+    """
+    num_qubits = sum(len(block) for block in blocks)
+    result = xp.reshape(state, (2,) * num_qubits + (-1,))
+    for block, op in zip(blocks, ops):
+        size = len(block)
+        op = xp.reshape(op, (2,) * (2 * size))
+        result = xp.tensordot(op, result,
+                              axes=(list(range(size, 2 * size)), list(block)))
+        # tensordot puts the block's axes first; move them back in place
+        result = xp.moveaxis(result, list(range(size)), list(block))
+    return xp.reshape(result, state.shape)
@@ -0,0 +1,57 @@
+from typing import Callable, Tuple
+
+# Plain IBU updates in a single SQUAREM cycle
+UPDATES_PER_CYCLE = 3
+
+
+def squarem_step(em_update: Callable, loglik: Callable, guess, xp) -> Tuple:
+    """
+    A single SQUAREM cycle (scheme SqS3 of Varadhan & Roland, 2008) on top of
+    the IBU fixed-point iteration: two plain IBU updates, an extrapolation
+    along the squared update direction and one stabilizing IBU update from the
+    extrapolated point. As safeguards, the extrapolated guess is clipped to be
+    non-negative and renormalized, and the cycle falls back to the two plain
+    updates whenever it would lower the likelihood of the observations.
+    Written against the shared numpy/jax.numpy API so the same cycle can run
+    eagerly, inside a jax while loop or vmapped over a batch.
+
+    :param em_update: a single IBU update, mapping a guess (probabilities, NOT
+                      log probabilities) to the updated guess and the norm
+                      difference between the two
+    :param loglik: the log-likelihood of the observations under a guess
+    :param guess: the current guess
+    :param xp: the array module of guess (numpy or jax.numpy)
+    :return: the new guess and the norm difference of the first, plain update
+             (the quantity that IBU compares against its tolerance)
+    """
+    guess1, diff = em_update(guess)
+    guess2, _ = em_update(guess1)
+
+    r = guess1 - guess
+    v = guess2 - 2 * guess1 + guess
+    r_norm = xp.sqrt(xp.sum(r ** 2))
+    v_norm = xp.sqrt(xp.sum(v ** 2))
+    # alpha = -1 recovers the two plain updates
+    alpha = xp.where(v_norm > 0, -r_norm / xp.where(v_norm > 0, v_norm, 1), -1)
+    alpha = xp.minimum(alpha, -1)
+
+    extrap = guess - 2 * alpha * r + alpha ** 2 * v
+    extrap = xp.maximum(extrap, 0)
+    extrap = extrap / xp.sum(extrap)
+    accel, _ = em_update(extrap)
+
+    accel_loglik = loglik(accel)
+    accept = xp.isfinite(accel_loglik) & (accel_loglik >= loglik(guess))
+    guess = xp.where(accept, accel, guess2)
+
+    return guess, diff
+
+
+def obs_loglik(obs, obs_guess, xp):
+    """
+    The log-likelihood of observed (normalized) counts obs under the
+    distribution over observed bitstrings obs_guess = R * guess, as maximized
+    by IBU. Bitstrings that were never observed do not contribute.
+    """
+    safe_guess = xp.where(obs > 0, obs_guess, 1)
+    return xp.sum(xp.where(obs > 0, obs * xp.log(safe_guess), 0))
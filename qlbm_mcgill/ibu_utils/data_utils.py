@@ -1,10 +1,14 @@
 import numpy as np
-import tensorflow as tf
-import jax.numpy as jnp
+from ibu_utils.lazy_utils import LazyModule
 from typing import List, Tuple
 from tqdm import trange
 from datetime import datetime
 from collections import defaultdict
+from itertools import combinations
+
+# tensorflow and jax are only imported once a function uses them
+tf = LazyModule("tensorflow")
+jnp = LazyModule("jax.numpy")
 
 
 def get_log_dir(params):
@@ -114,6 +118,89 @@ def expand_strs_by_hamdist(strs_list, ham_dist, desc):
     return expanded_bitstrs
 
 
+def strs_to_bits(strs_list):
+    """
+        Converts a K-list of N-length bitstrings into a K x N uint8 matrix of
+        0s and 1s, in the same order as the characters of each bitstring
+        (unlike strs_to_mat(), which reverses them). Vectorized: the strings
+        are parsed in one pass over their joined bytes.
+    """
+    num_bits = len(strs_list[0])
+    bits = np.frombuffer("".join(strs_list).encode(), dtype=np.uint8)
+    return bits.reshape(len(strs_list), num_bits) - ord('0')
+
+
+def bits_to_strs(bits):
+    """
+        Converts a K x N matrix of 0s and 1s (see strs_to_bits()) back into a
+        K-list of N-length bitstrings.
+    """
+    chars = np.ascontiguousarray(bits, dtype=np.uint8) + ord('0')
+    return chars.view(f'S{bits.shape[1]}').ravel().astype(str).tolist()
+
+
+def bits_to_mat(bits, library):
+    """
+        Converts a K x N matrix of 0s and 1s (see strs_to_bits()) into the
+        bit-reversed K x N matrix returned by strs_to_mat(), in the desired
+        library (only jax currently supported).
+    """
+    if library == 'jax':
+        mat = jnp.array(bits[:, ::-1], dtype=int)
+    else:
+        raise "Unsupported library!"
+
+    return mat
+
+
+def hamming_masks(num_bits, ham_dist):
+    """
+        Returns every N-bit XOR mask that flips between 1 and ham_dist bits,
+        as an M x N uint8 matrix of 0s and 1s, where M = sum_d (N choose d).
+    """
+    masks = []
+    for d in range(1, ham_dist + 1):
+        flips = np.array(list(combinations(range(num_bits), d)))
+        mask = np.zeros([len(flips), num_bits], dtype=np.uint8)
+        mask[np.arange(len(flips))[:, None], flips] = 1
+        masks.append(mask)
+    return np.concatenate(masks)
+
+
+def expand_bits_by_hamdist(bits, ham_dist):
+    """
+        Vectorized counterpart of expand_strs_by_hamdist(): given a K x N
+        matrix of observed bitstrings as 0s and 1s, returns every bitstring no
+        more than hamming distance ham_dist away from at least one of them
+        (including the observed bitstrings themselves), deduplicated and in
+        sorted order, as an E x N matrix of 0s and 1s.
+        Bitstrings are packed into bytes, so the expansion is a single XOR of
+        every observed bitstring against every hamming mask, for any N.
+    :param bits: a K x N matrix of 0s and 1s (see strs_to_bits())
+    :param ham_dist: hamming distance from the observed bitstrings
+    :return: an E x N uint8 matrix of 0s and 1s
+    """
+    num_bits = bits.shape[1]
+    packed = np.packbits(bits, axis=1)
+    if ham_dist > 0:
+        masks = np.packbits(hamming_masks(num_bits, ham_dist), axis=1)
+        flipped = (packed[:, None, :] ^ masks[None, :, :]).reshape(
+            -1, packed.shape[1])
+        packed = np.concatenate([packed, flipped])
+    # Rows of packed bytes sort in the same (lexicographic) order as the
+    # bitstrings they encode
+    if packed.shape[1] <= 8:
+        # Up to 64 bits, each row is read as one big-endian integer, which is
+        # much faster to deduplicate than rows
+        padded = np.zeros([packed.shape[0], 8], dtype=np.uint8)
+        padded[:, :packed.shape[1]] = packed
+        ints = np.unique(padded.view('>u8').ravel())
+        packed = ints.astype('>u8').view(np.uint8).reshape(-1, 8)
+    else:
+        packed = np.unique(packed, axis=0)
+    return np.unpackbits(packed, axis=1, count=num_bits)
+
+
 ################################################################################
 #                             DATA PREPROCESSING
 ################################################################################
@@ -0,0 +1,56 @@
+import importlib
+from functools import wraps
+
+
+class LazyModule:
+    """
+        Stand-in for a module that is only imported on first attribute access.
+        Used for the heavy tensorflow/jax imports, so that e.g. the numpy
+        engine of IBUFull never pays for importing them.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+def lazy_jit(fun, **jit_kwargs):
+    """
+        Drop-in replacement for jax.jit(fun, **jit_kwargs) that defers both
+        importing jax and compiling fun to the first call. Works on methods in
+        the same way as jax.jit (e.g. with static_argnums=(0,) for self).
+    """
+    compiled = None
+
+    @wraps(fun)
+    def wrapper(*args, **kwargs):
+        nonlocal compiled
+        if compiled is None:
+            import jax
+            compiled = jax.jit(fun, **jit_kwargs)
+        return compiled(*args, **kwargs)
+
+    return wrapper
+
+
+def lazy_vmap(fun, **vmap_kwargs):
+    """
+        Drop-in replacement for jax.vmap(fun, **vmap_kwargs) that defers
+        importing jax to the first call (or trace, e.g. inside lazy_jit).
+    """
+    vectorized = None
+
+    @wraps(fun)
+    def wrapper(*args, **kwargs):
+        nonlocal vectorized
+        if vectorized is None:
+            import jax
+            vectorized = jax.vmap(fun, **vmap_kwargs)
+        return vectorized(*args, **kwargs)
+
+    return wrapper
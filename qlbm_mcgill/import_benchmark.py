@@ -0,0 +1,69 @@
+"""
+Import-time benchmark for qlbm-mcgill.
+Imports each runner module in a fresh interpreter and fails (exit code 1) if a cold import
+takes longer than the budget, or if it pulls in a heavy dependency that should only be
+loaded by the code paths that use it.
+
+Usage (from the qlbm_mcgill directory):
+    python import_benchmark.py [budget in seconds] [repeats]
+"""
+import subprocess
+import sys
+
+# "Macros"
+DEFAULT_BUDGET = 6.0 # seconds
+DEFAULT_REPEATS = 3
+MODULES = ["animation", "base", "simulation", "noise_sim", "error_mitigator", "ibm_qpu"]
+LAZY_MODULES = ["tensorflow", "jax", "pyvista", "mitiq", "qiskit_experiments", "IPython"]
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+loaded = [m for m in {lazy} if m in sys.modules]
+print(f"{{elapsed}}|{{','.join(loaded)}}")
+"""
+
+def time_import(module: str) -> tuple[float, list[str]]:
+    """
+    Cold-imports a module in a fresh interpreter.
+    Returns the import time in seconds and the heavy dependencies it loaded.
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, lazy=LAZY_MODULES)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    elapsed, loaded = result.stdout.strip().splitlines()[-1].split("|")
+    return float(elapsed), [m for m in loaded.split(",") if m != ""]
+
+def benchmark(
+        budget: float = DEFAULT_BUDGET,
+        repeats: int = DEFAULT_REPEATS
+    ) -> bool:
+    """
+    Times the cold import of every runner module (best of "repeats").
+    Returns whether every module stayed within the budget without loading heavy dependencies.
+    """
+    passed = True
+    for module in MODULES:
+        timings = [time_import(module) for _ in range(repeats)]
+        elapsed = min(t for t, _ in timings)
+        loaded = timings[0][1]
+
+        status = "ok"
+        if elapsed > budget:
+            status = f"FAIL: over {budget} s budget"
+            passed = False
+        if loaded:
+            status = f"FAIL: eagerly imports {', '.join(loaded)}"
+            passed = False
+        print(f"{module:<16} {elapsed:6.2f} s  {status}")
+    return passed
+
+if __name__ == "__main__":
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_REPEATS
+    sys.exit(0 if benchmark(budget, repeats) else 1)
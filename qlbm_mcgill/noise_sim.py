@@ -3,7 +3,8 @@ from base import *
 class Noise_Simulation2D(Runner):
     """
     Performs a noisy 2D QLBM simulation without reinitialization (i.e., significantly less optimized).
-    Scales in O(n^2) for n steps compared to Simulation2D's O(n).
+    Scales in O(n^2) for n steps compared to Simulation2D's O(n), unless "snapshots" is set: then a 
+    single circuit with all n steps is run, saving the grid distribution after every step, in O(n).
     Attributes:
         single_depolarizing_prob: float, single qubit gate error probability
         double_depolarizing_prob: float, double qubit gate error probability
@@ -11,6 +12,9 @@ class Noise_Simulation2D(Runner):
         lattice: CollisionlessLattice
         dims: tuple | list
         label: str, name of the file without the extension
+        num_processes: int | None, the number of processes to transpile the circuits with in parallel 
+            (None: Qiskit's default, i.e. every CPU)
+        snapshots: bool, run a single circuit with probability snapshots instead of one circuit per step
     """
      
     single_depolarizing_prob: float
@@ -19,15 +23,20 @@ class Noise_Simulation2D(Runner):
     lattice: CollisionlessLattice
     dims: tuple | list
     label: str
+    num_processes: int | None
+    snapshots: bool
 
     def __init__(
             self, 
             single_prob: float, 
             double_prob: float, 
             dims: tuple | list, 
-            vs: tuple | list = [4,4]
+            vs: tuple | list = [4,4],
+            num_processes: int | None = None,
+            snapshots: bool = False
         ) -> None:
           
+        super().__init__()
         self.dims = dims
         self.lattice = CollisionlessLattice(
             {
@@ -35,42 +44,61 @@ class Noise_Simulation2D(Runner):
             }
         )
 
+        self.num_processes = num_processes
+        self.snapshots = snapshots
+
         self.single_depolarizing_prob = single_prob
         self.double_depolarizing_prob = double_prob
 
-        self.noise_model = NoiseModel()
-        self.noise_model.add_all_qubit_quantum_error(
-            depolarizing_error(double_prob, 2), ["cx"]
-        )
-        self.noise_model.add_all_qubit_quantum_error(
-            depolarizing_error(single_prob, 1), ["u", "u3", "p", "h", "measure"]
-        )
+        self.noise_model = depolarizing_noise_model(single_prob, double_prob)
 
     @override
     def run(
         self, 
         steps: int, 
         shots: int = DEFAULT_SHOTS
-        ) -> list:
+        ) -> Counts:
 
-        step_qcs = [StepCircuit(self.lattice, i).circuit.decompose() for i in range(steps+1)]
-        
-        noisy_sampler = SimSampler(
-            options=dict(backend_options=dict(noise_model=self.noise_model))
-        )
-        # The circuit needs to be transpiled to the AerSimulator target
-        pass_manager = generate_preset_pass_manager(3, AerSimulator())
-        qcs = [pass_manager.run(qc) for qc in step_qcs]
-        job = noisy_sampler.run(qcs, shots=shots)
-        result = job.result()
-        
-        counts = [list(result[i].data.values())[0].get_counts() for i in range(steps+1)]
-        return counts
+        qcs = self.transpile(steps)
+        with self.stage("execute"):
+            return simulate(
+                qcs, 
+                steps, 
+                shots, 
+                self.single_depolarizing_prob, 
+                self.double_depolarizing_prob, 
+                self.snapshots
+            )
+
+    def transpile(self, steps: int) -> list[QuantumCircuit]:
+        """
+        Builds and transpiles the circuits of "steps" steps (to the AerSimulator target): one per step,
+        or with "snapshots" a single circuit with all steps that saves the probabilities of the grid 
+        qubits after the initial conditions and after every step. The circuits do not depend on the 
+        noise, so they can be simulated with any noise parameters (see noise_sweep).
+        """
+        with self.stage("build"):
+            builder = StepCircuitBuilder.for_lattice(self.lattice)
+
+            if self.snapshots:
+                qc = builder.init_circuit.copy()
+                qc.save_probabilities(builder.measured_qubits, label="step0")
+                for step in range(1, steps + 1):
+                    qc.compose(builder.step_circuit, inplace=True)
+                    qc.save_probabilities(builder.measured_qubits, label=f"step{step}")
+                step_qcs = [qc.decompose()]
+            else:
+                step_qcs = [qc.decompose() for qc in builder.circuits(steps)]
+
+        with self.stage("transpile"):
+            # The circuit needs to be transpiled to the AerSimulator target
+            pass_manager = generate_preset_pass_manager(3, AerSimulator())
+            return pass_manager.run(step_qcs, num_processes=self.num_processes)
 
     @override
     def visualize(
         self, 
-        counts: list,
+        counts: list | Counts,
         steps: int, 
         shots: int = DEFAULT_SHOTS
         ) -> str:
@@ -91,3 +119,96 @@ class Noise_Simulation2D(Runner):
         vis = self.visualize(counts, steps, shots=shots)
         print("Done.")
         return vis 
+
+
+def depolarizing_noise_model(
+        single_prob: float, 
+        double_prob: float
+    ) -> NoiseModel:
+    """
+    The noise model of Noise_Simulation2D: depolarizing errors on every single qubit gate (and 
+    measurement) and on every CNOT.
+    """
+    noise_model = NoiseModel()
+    noise_model.add_all_qubit_quantum_error(
+        depolarizing_error(double_prob, 2), ["cx"]
+    )
+    noise_model.add_all_qubit_quantum_error(
+        depolarizing_error(single_prob, 1), ["u", "u3", "p", "h", "measure"]
+    )
+    return noise_model
+
+def simulate(
+        qcs: list[QuantumCircuit], 
+        steps: int, 
+        shots: int, 
+        single_prob: float, 
+        double_prob: float, 
+        snapshots: bool = False
+    ) -> Counts:
+    """
+    Simulates the circuits of Noise_Simulation2D.transpile under depolarizing noise.
+    With "snapshots", the saved probabilities are averaged over "shots" noisy trajectories and "shots" 
+    counts are sampled from them. The depolarizing error of the measurements (which are never run) is 
+    applied to the probabilities instead: it flips every measured bit with probability p/2.
+    """
+    noise_model = depolarizing_noise_model(single_prob, double_prob)
+
+    if not snapshots:
+        noisy_sampler = SimSampler(
+            options=dict(backend_options=dict(noise_model=noise_model))
+        )
+        job = noisy_sampler.run(qcs, shots=shots)
+        result = job.result()
+        
+        counts = Counts.from_bit_arrays([list(result[i].data.values())[0] for i in range(steps+1)])
+        return counts
+
+    simulator = AerSimulator(method="statevector", noise_model=noise_model)
+    result = simulator.run(qcs[0], shots=shots).result()
+    # Probabilities are indexed with the first measured qubit as the least significant bit, as counts are
+    probs = np.array([result.data(0)[f"step{step}"] for step in range(steps + 1)])
+
+    flip = single_prob / 2
+    probs = probs.reshape([steps + 1] + [2] * int(log2(probs.shape[1])))
+    for axis in range(1, probs.ndim):
+        probs = (1 - flip) * probs + flip * np.flip(probs, axis=axis)
+    probs = probs.reshape(steps + 1, -1)
+
+    rng = np.random.default_rng()
+    dense = np.array([rng.multinomial(shots, prob / prob.sum()) for prob in probs])
+    return Counts.from_dense(dense, tol=0)
+
+def noise_sweep(
+        dims_list: list[tuple | list], 
+        noise_params: list[tuple[float, float]], 
+        steps: int, 
+        shots: int = DEFAULT_SHOTS, 
+        vs: tuple | list = [4,4], 
+        snapshots: bool = False, 
+        max_workers: int | None = None
+    ) -> dict[tuple, Counts]:
+    """
+    Runs a noisy simulation for every lattice size in "dims_list" and every (single_prob, double_prob)
+    pair in "noise_params". The circuits of every lattice size are only built and transpiled once, and
+    the simulations are spread over a pool of "max_workers" processes (None: one per CPU).
+    Returns a table of the counts of every simulation, keyed by (dims, single_prob, double_prob).
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import get_context
+
+    circuits = {
+        tuple(dims): Noise_Simulation2D(0, 0, dims, vs=vs, snapshots=snapshots).transpile(steps)
+        for dims in dims_list
+    }
+
+    # Forking after Aer (OpenMP) has started its threads can deadlock the workers, so they are spawned
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn")) as pool:
+        futures = {
+            (dims, single_prob, double_prob): pool.submit(
+                simulate, qcs, steps, shots, single_prob, double_prob, snapshots
+            )
+            for dims, qcs in circuits.items()
+            for single_prob, double_prob in noise_params
+        }
+        return {key: future.result() for key, future in futures.items()}
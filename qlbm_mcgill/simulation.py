@@ -1,5 +1,64 @@
 from base import *
 
+class TimestepHook():
+    """
+    Result mixin that calls "on_timestep(counts, timestep)" every time the counts of a timestep are
+    saved, after saving them. "create_vis" (if not None) overrides whether ".vti" files are written.
+    """
+    on_timestep: Callable[[dict, int], None]
+    create_vis: bool | None
+
+    def save_timestep_counts(
+            self, 
+            counts: dict, 
+            timestep: int, 
+            create_vis: bool = True, 
+            save_array: bool = False
+        ):
+        if self.create_vis is not None:
+            create_vis = self.create_vis
+        super().save_timestep_counts(counts, timestep, create_vis, save_array)
+        self.on_timestep(counts, timestep)
+
+class HookedCollisionlessResult(TimestepHook, CollisionlessResult):
+    pass
+
+class HookedSpaceTimeResult(TimestepHook, SpaceTimeResult):
+    pass
+
+class HookedQiskitRunner(QiskitRunner):
+    """
+    QiskitRunner whose results call "on_timestep(counts, timestep)" after saving the counts of every
+    timestep (see TimestepHook), e.g. to report progress or keep the counts in memory.
+    """
+    on_timestep: Callable[[dict, int], None]
+    create_vis: bool | None
+
+    def __init__(
+            self, 
+            config: SimulationConfig, 
+            lattice: CollisionlessLattice | SpaceTimeLattice, 
+            on_timestep: Callable[[dict, int], None], 
+            create_vis: bool | None = None
+        ) -> None:
+        super().__init__(config, lattice)
+        self.on_timestep = on_timestep
+        self.create_vis = create_vis
+
+    @override
+    def new_result(
+            self, 
+            output_directory: str, 
+            output_file_name: str
+        ) -> HookedCollisionlessResult | HookedSpaceTimeResult:
+        if isinstance(self.lattice, CollisionlessLattice):
+            result = HookedCollisionlessResult(self.lattice, output_directory, output_file_name)
+        else:
+            result = HookedSpaceTimeResult(self.lattice, output_directory, output_file_name)
+        result.on_timestep = self.on_timestep
+        result.create_vis = self.create_vis
+        return result
+
 class Simulation2D(Runner):
     """
     2D simulation with collision (STM) and collisionless (QTM) conditions and no obstacles.
@@ -9,14 +68,14 @@ class Simulation2D(Runner):
         dims: tuple | list, x & y dimensions
         collision: bool, whether the lattice has collision
         label: str, name of the simulation file
-        active: bool, whether or not the simulation is actively running (for the timer)
+        step_counts: list[dict], counts of every step of the last run
     """
 
     lattice: Lattice | SpaceTimeLattice
     dims: tuple | list
     collision: bool
     label: str
-    active: bool
+    step_counts: list[dict]
 
     def __init__(
         self, 
@@ -27,10 +86,11 @@ class Simulation2D(Runner):
         """
         vs: tuple | list, x & y velocities, default to [4,4]
         """
+        super().__init__()
         print(f"Preparing {dims[0]}x{dims[1]} simulation...")
-        self.active = False
         self.dims = dims
         self.collision = collision
+        self.step_counts = []
         if collision:
             self.lattice = SpaceTimeLattice(
             num_timesteps=1,
@@ -89,21 +149,38 @@ class Simulation2D(Runner):
                 sampling_backend=AerSimulator(method="statevector"),
             )
         
-        sim_thread = threading.Thread(target=self.sim, args=((cfg, steps, shots,)))
-        time_thread = threading.Thread(target=self.timer)
-        sim_thread.start()
-        time_thread.start()
-        sim_thread.join()
-        time_thread.join()
+        self.sim(cfg, steps, shots)
         print("Simulation complete.")
 
     @override
     def visualize(self) -> str:
         print("Visualizing... ", end="")
-        pv.set_plot_theme(themes.ParaViewTheme())
-        create_animation(f"qlbm-output/{self.label}/paraview", f"{self.label}.gif")
+        if self.render_backend == "pyvista":
+            import pyvista as pv
+            from pyvista import themes
+            pv.set_plot_theme(themes.ParaViewTheme())
+        output_filename = f"{self.label}.{self.animation_format}"
+        with self.stage("render"):
+            if self.collision:
+                create_animation(
+                    f"qlbm-output/{self.label}/paraview",
+                    output_filename,
+                    num_processes=self.render_processes,
+                    colors=self.animation_colors,
+                    backend=self.render_backend
+                )
+            else:
+                animate_frames(
+                    counts_to_frames(self.lattice, self.step_counts),
+                    self.lattice,
+                    output_filename,
+                    on_frame=lambda i, n: self.progress("render", i, n),
+                    num_processes=self.render_processes,
+                    colors=self.animation_colors,
+                    backend=self.render_backend
+                )
         print("done.")
-        return f"{self.label}.gif"
+        return output_filename
 
     @override
     def make(self, 
@@ -114,37 +191,35 @@ class Simulation2D(Runner):
         vis = self.visualize()
         return vis
 
-    def timer(self):
-        """
-        Basic timer, to be run in a separate thread, to track how long the simulation takes.
-        """
-        start = int(time.time())
-        time.sleep(1)
-        while self.active:
-            time.sleep(0.9)
-            diff = int(time.time()) - start
-            print("\r", end="")
-            print(f"Time elapsed: {int(diff/60)} minute(s) and {diff % 60} second(s).", end="")
-        print()
-
     def sim(self, 
             cfg: SimulationConfig, 
             steps: int, 
             shots: int = DEFAULT_SHOTS
         ) -> None:
-        self.active = True
         """
         Helper function; runs a Qiskit simulation given config, lattice, directory, number of steps and shots.
+        Emits a progress event every time the counts of a step are saved, and keeps the counts in
+        self.step_counts. Collisionless steps are only written to ".vti" files if self.save_vti is set.
         """
-        cfg.prepare_for_simulation()
-        runner = QiskitRunner(
-            cfg,
-            self.lattice,
-        )
-        runner.run(
-            steps,  # Number of time steps
-            shots,  # Number of shots per time step
-            f"qlbm-output/{self.label}",
-            statevector_snapshots=True,
-        )
-        self.active = False
\ No newline at end of file
+        self.step_counts = []
+
+        def on_timestep(counts: dict, timestep: int):
+            self.step_counts.append(counts)
+            self.progress("execute", timestep, steps)
+
+        with self.stage("build"):
+            cfg.prepare_for_simulation()
+            runner = HookedQiskitRunner(
+                cfg,
+                self.lattice,
+                on_timestep,
+                create_vis=None if self.collision else self.save_vti,
+            )
+
+        with self.stage("execute"):
+            runner.run(
+                steps,  # Number of time steps
+                shots,  # Number of shots per time step
+                f"qlbm-output/{self.label}",
+                statevector_snapshots=True,
+            )
\ No newline at end of file